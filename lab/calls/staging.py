@@ -0,0 +1,60 @@
+"""Let runs read node-local copies of files from the shared file system.
+
+If *staging_dir* is set for :py:class:`~lab.environments.SlurmEnvironment`,
+each run dir contains the file "staging-manifest". It lists the paths of
+the resources declared for the experiment and the run, i.e., the top-level
+entries of the experiment dir (e.g., the code of cached revisions) and the
+directories of symlinked run files (e.g., benchmark domains). Each line has
+four tab-separated fields: a path as it may appear in the run's commands,
+its staged path, the file or directory to copy and its copy destination.
+Destinations are relative to the staging dir.
+
+Before executing a run, the Slurm job copies the listed entries once per
+node (see "slurm-run-job-body.template"). The run script then passes the
+command-line arguments through :py:func:`stage_args_from_environment`.
+
+"""
+
+import os
+
+MANIFEST_FILENAME = "staging-manifest"
+
+
+def format_manifest(entries):
+    return "".join("\t".join(entry) + "\n" for entry in entries)
+
+
+def read_manifest(path):
+    with open(path) as f:
+        return [tuple(line.rstrip("\n").split("\t")) for line in f if line.strip()]
+
+
+def stage_args(args, entries, staging_dir):
+    """Replace the paths listed in *entries* in *args* by their staged copies.
+
+    Only the listed paths and paths below them are replaced. The first
+    argument (the executable) is never replaced. Paths whose copy is
+    missing, e.g., because copying failed, are kept.
+
+    """
+    new_args = list(args[:1])
+    for arg in args[1:]:
+        for arg_path, staged_path, _, _ in entries:
+            if isinstance(arg, str) and (
+                arg == arg_path or arg.startswith(arg_path + os.sep)
+            ):
+                staged_arg = os.path.join(staging_dir, staged_path)
+                staged_arg += arg[len(arg_path) :]
+                if os.path.exists(staged_arg):
+                    arg = staged_arg
+                break
+        new_args.append(arg)
+    return new_args
+
+
+def stage_args_from_environment(args):
+    """Call :py:func:`stage_args` if the job has staged the run's files."""
+    staging_dir = os.environ.get("LAB_STAGING_DIR")
+    if not staging_dir or not os.path.exists(MANIFEST_FILENAME):
+        return args
+    return stage_args(args, read_manifest(MANIFEST_FILENAME), staging_dir)
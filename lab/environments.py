@@ -1,3 +1,4 @@
+import hashlib
 import logging
 import math
 import multiprocessing
@@ -6,7 +7,9 @@ import platform
 import random
 import re
 import subprocess
-import sys
+import time
+from collections import defaultdict
+from itertools import chain
 from pathlib import Path
 
 from lab import tools
@@ -18,6 +21,23 @@ def _get_job_prefix(exp_name):
     return "".join([escape_char, exp_name, "-"])
 
 
+def _get_memory_in_mib(memory):
+    """Convert a Slurm memory specification to MiB.
+
+    >>> _get_memory_in_mib("3872M")
+    3872
+    >>> _get_memory_in_mib("9G")
+    9216
+    >>> _get_memory_in_mib("2048")
+    2048
+    """
+    factors = {"K": 1 / 1024, "M": 1, "G": 1024, "T": 1024**2}
+    memory = str(memory).upper()
+    if memory[-1] in factors:
+        return int(float(memory[:-1]) * factors[memory[-1]])
+    return int(memory)
+
+
 def is_build_step(step):
     """Return true iff the given step is the "build" step."""
     return step._funcname == "build"
@@ -31,7 +51,7 @@ def is_run_step(step):
 class Environment:
     """Abstract base class for all environments."""
 
-    def __init__(self, randomize_task_order=True):
+    def __init__(self, randomize_task_order=True, parse_after_run=False):
         """
         If *randomize_task_order* is True (default), tasks for runs are
         started in a random order. This is useful to avoid systematic
@@ -40,9 +60,18 @@ class Environment:
         run directories may be pristine while the experiment is running
         even though the logs say the runs are finished.
 
+        If *parse_after_run* is True, each run is parsed with the
+        experiment's parsers right after it finishes, i.e., on the
+        compute node that executed it. This spreads the parsing work
+        across all workers and the "parse" step only has to parse runs
+        that have no "properties" file yet. For this to work, the
+        experiment script must not be changed while the experiment is
+        running.
+
         """
         self.exp = None  # Set by Experiment.
         self.randomize_task_order = randomize_task_order
+        self.parse_after_run = parse_after_run
 
     def _get_task_order(self, num_tasks):
         task_order = list(range(1, num_tasks + 1))
@@ -88,10 +117,19 @@ class LocalEnvironment(Environment):
         self.processes = processes
 
     def write_main_script(self):
+        parse_command = None
+        if self.parse_after_run:
+            parse_command = [
+                tools.get_python_executable(),
+                tools.get_script_path(),
+                "--parse-run-dir",
+            ]
         script = tools.fill_template(
             "local-job.py",
             task_order=self._get_task_order(len(self.exp.runs)),
             processes=self.processes,
+            parse_command=parse_command,
+            parse_cwd=repr(os.getcwd()),
         )
 
         self.exp.add_new_file("", self.EXP_RUN_SCRIPT, script, permissions=0o755)
@@ -189,6 +227,62 @@ class SlurmEnvironment(Environment):
     ...     extra_options="#SBATCH -C fat",
     ... )
 
+    If *group_runs_by_resources* is True, the runs are split into
+    several array jobs that only reserve the cores their runs need.
+    For each run, Lab takes the largest ``memory_limit`` of its
+    commands (see :py:func:`~lab.experiment.Run.add_command`) and
+    reserves ``ceil(memory_limit / memory_per_cpu)`` cores per task,
+    but at least *cpus_per_task* cores. Runs that need the same number
+    of cores land in the same array job, and later steps wait for all
+    of these jobs. This avoids reserving the maximum amount of memory
+    for all runs in experiments that mix small and large memory limits:
+
+    >>> # Runs with memory_limit=2048 use 1 core per task and runs
+    >>> # with memory_limit=16384 use 3 cores per task.
+    >>> env = BaselSlurmEnvironment(
+    ...     partition="infai_2",
+    ...     memory_per_cpu="6354M",
+    ...     group_runs_by_resources=True,
+    ... )
+
+    If *staging_dir* is given, it must be a directory on node-local
+    storage, e.g., "/scratch/$USER/lab-staging". Bash variables are
+    expanded on the compute node. Before executing a run, the job then
+    copies the resources declared for the experiment and the run to a
+    subdirectory of *staging_dir* and the run passes the local copies to
+    its commands instead. Staged are the top-level entries of the
+    experiment directory that hold experiment resources (e.g., the
+    ``code-*`` directories of cached revisions) and the directories
+    containing the sources of symlinked resources (e.g., benchmark
+    domains). The first argument of a command (the executable, e.g., the
+    Python interpreter) is never replaced. Each entry is copied once per
+    node, guarded by a file lock, so that thousands of concurrent runs
+    don't all read from the shared file system. Lab doesn't delete the
+    staged files after the experiment. The staging dir must be shared by
+    all tasks on a node, so avoid directories that Slurm creates per job
+    (on many clusters, this includes "$TMPDIR").
+
+    If a node fails or Slurm preempts a task, the runs of this task
+    remain unfinished: they have a ``driver.log`` file that lacks the
+    exit status of the run script, which the Slurm job appends after
+    the run script ends. Use *max_retries* to restart such runs
+    automatically (default: 0). Lab then submits up to *max_retries*
+    additional array jobs for the runs, each of which starts only after
+    the previous array job has ended (``afterany`` dependency). Since
+    all tasks of the previous array job have terminated by then, every
+    run without exit status was interrupted and is executed again after
+    deleting its ``driver.*`` and ``run.*`` files. Finished runs are
+    skipped. Each task leaves a marker file in the ``-grid-steps``
+    directory until all of its runs have ended. If no marker of the
+    previous attempt is left, i.e., no task was interrupted, the first
+    tasks of a retry job cancel the whole retry array job with
+    ``scancel``, so its other tasks don't wait in the queue.
+
+    Slurm also ends tasks that exceed *time_limit_per_task* (TIMEOUT),
+    and Lab can't tell these apart from tasks on failed nodes. Their
+    unfinished runs are restarted as well and will likely time out
+    again, so choose a time limit that suffices for all runs of a task.
+
     Use *export* to specify a list of environment variables that
     should be exported from the login node to the compute nodes
     (default: ["PATH"]).
@@ -245,6 +339,9 @@ class SlurmEnvironment(Environment):
         cpus_per_task=1,
         export=None,
         setup=None,
+        group_runs_by_resources=False,
+        staging_dir=None,
+        max_retries=0,
         **kwargs,
     ):
         super().__init__(**kwargs)
@@ -272,6 +369,10 @@ class SlurmEnvironment(Environment):
         self.cpus_per_task = cpus_per_task
         self.export = export
         self.setup = setup
+        self.group_runs_by_resources = group_runs_by_resources
+        self.staging_dir = staging_dir
+        self._staging_subdir = None
+        self.max_retries = max_retries
 
     @classmethod
     def is_present(cls):
@@ -288,32 +389,86 @@ class SlurmEnvironment(Environment):
             f"{self.exp.steps.index(step) + 1:02d}-{step.name}"
         )
 
-    def _get_num_runs_per_task(self):
-        return math.ceil(len(self.exp.runs) / self.MAX_TASKS)
+    def _get_num_runs_per_task(self, num_runs):
+        return math.ceil(num_runs / self.MAX_TASKS)
 
-    def _get_num_tasks(self, step):
+    def _get_num_tasks(self, step, num_runs=None):
         if is_run_step(step):
-            num_runs = len(self.exp.runs)
-            num_tasks = math.ceil(num_runs / self._get_num_runs_per_task())
+            if num_runs is None:
+                num_runs = len(self.exp.runs)
+            num_tasks = math.ceil(num_runs / self._get_num_runs_per_task(num_runs))
         else:
             num_tasks = 1
         return num_tasks
 
-    def _get_job_header(self, step, is_last):
-        job_params = self._get_job_params(step, is_last)
+    def _get_run_groups(self):
+        """Return a list of (cpus_per_task, run IDs) pairs.
+
+        Each pair becomes a separate array job. If
+        *group_runs_by_resources* is False, all runs form a single group.
+
+        """
+        run_ids = list(range(1, len(self.exp.runs) + 1))
+        if not self.group_runs_by_resources:
+            return [(self.cpus_per_task, run_ids)]
+        memory_per_cpu = _get_memory_in_mib(self.memory_per_cpu)
+        groups = defaultdict(list)
+        for run_id, run in zip(run_ids, self.exp.runs, strict=True):
+            # Runs execute their commands sequentially, so the largest memory
+            # limit determines the amount of memory the run needs.
+            memory_limits = [
+                kwargs["memory_limit"]
+                for _, kwargs in chain(
+                    self.exp.commands.values(), run.commands.values()
+                )
+                if kwargs.get("memory_limit") is not None
+            ]
+            cpus_per_task = self.cpus_per_task
+            if memory_limits:
+                cpus_per_task = max(
+                    cpus_per_task, math.ceil(max(memory_limits) / memory_per_cpu)
+                )
+            groups[cpus_per_task].append(run_id)
+        return sorted(groups.items())
+
+    def _get_job_header(self, step, is_last, cpus_per_task=None, run_ids=None):
+        job_params = self._get_job_params(step, is_last, cpus_per_task, run_ids)
         return tools.fill_template(self.JOB_HEADER_TEMPLATE_FILE, **job_params)
 
-    def _get_run_job_body(self, run_step):
-        num_runs = len(self.exp.runs)
-        num_tasks = self._get_num_tasks(run_step)
-        logging.info(f"Grouping {num_runs} runs into {num_tasks} Slurm tasks.")
+    def _get_staging_setup(self):
+        if not self.staging_dir:
+            return "## (not used)"
+        if self._staging_subdir is None:
+            # Use a new dir for each submission to never use stale copies.
+            digest = hashlib.md5(f"{self.exp.path}:{time.time()}".encode()).hexdigest()
+            self._staging_subdir = f"lab-staging-{self.exp.name}-{digest[:8]}"
+        return f'export LAB_STAGING_DIR="{self.staging_dir}/{self._staging_subdir}"'
+
+    def _get_run_job_body(self, run_step, run_ids=None, retry=0, cpus_per_task=None):
+        if run_ids is None:
+            run_ids = list(range(1, len(self.exp.runs) + 1))
+        num_runs = len(run_ids)
+        num_tasks = self._get_num_tasks(run_step, num_runs)
+        if not retry:
+            logging.info(f"Grouping {num_runs} runs into {num_tasks} Slurm tasks.")
+        run_order = [run_ids[index - 1] for index in self._get_task_order(num_runs)]
         return tools.fill_template(
             self.RUN_JOB_BODY_TEMPLATE_FILE,
+            cwd=os.getcwd(),
             exp_path=self.exp.path,
             num_runs=num_runs,
+            parse_after_run=int(self.parse_after_run),
+            retry=int(retry > 0),
+            attempt=retry,
+            # Each array job of the run step has its own task markers.
+            task_marker_dir=self.job_dir
+            / "unfinished-tasks"
+            / f"{cpus_per_task or self.cpus_per_task}cpus",
             python=tools.get_python_executable(),
-            runs_per_task=self._get_num_runs_per_task(),
-            run_order=" ".join(str(i) for i in self._get_task_order(num_runs)),
+            script=tools.get_script_path(),
+            runs_per_task=self._get_num_runs_per_task(num_runs),
+            run_order=" ".join(str(i) for i in run_order),
+            staging_setup=self._get_staging_setup(),
         )
 
     def _get_step_job_body(self, step):
@@ -321,17 +476,49 @@ class SlurmEnvironment(Environment):
             self.STEP_JOB_BODY_TEMPLATE_FILE,
             cwd=os.getcwd(),
             python=tools.get_python_executable(),
-            script=sys.argv[0],
+            script=tools.get_script_path(),
             step_name=step.name,
         )
 
-    def _get_job_body(self, step):
+    def _get_job_body(self, step, run_ids=None, retry=0, cpus_per_task=None):
         if is_run_step(step):
-            return self._get_run_job_body(step)
+            return self._get_run_job_body(step, run_ids, retry, cpus_per_task)
         return self._get_step_job_body(step)
 
-    def _get_job(self, step, is_last):
-        return f"{self._get_job_header(step, is_last)}\n\n{self._get_job_body(step)}"
+    def _get_job(self, step, is_last, cpus_per_task=None, run_ids=None, retry=0):
+        header = self._get_job_header(step, is_last, cpus_per_task, run_ids)
+        body = self._get_job_body(step, run_ids, retry, cpus_per_task)
+        return f"{header}\n\n{body}"
+
+    def _get_jobs(self, step, is_last, retry=0):
+        """Return a list of (job name, job content) pairs for *step*.
+
+        For *retry* > 0, the jobs only restart runs that were interrupted.
+
+        """
+        job_name = self._get_job_name(step)
+        if not is_run_step(step):
+            return [(job_name, self._get_job(step, is_last))]
+        if retry:
+            job_name += f"-retry{retry}"
+        groups = self._get_run_groups()
+        if len(groups) == 1:
+            [(cpus_per_task, run_ids)] = groups
+            return [
+                (job_name, self._get_job(step, is_last, cpus_per_task, run_ids, retry))
+            ]
+        if not retry:
+            logging.info(
+                f"Splitting runs into {len(groups)} array jobs with different "
+                f"numbers of cores per task."
+            )
+        return [
+            (
+                f"{job_name}-{cpus_per_task}cpus",
+                self._get_job(step, is_last, cpus_per_task, run_ids, retry),
+            )
+            for cpus_per_task, run_ids in groups
+        ]
 
     def write_main_script(self):
         # The main script is written by the run_steps() method.
@@ -343,6 +530,11 @@ class SlurmEnvironment(Environment):
         all at once with dependencies. We also can't rewrite the job
         files after they have been submitted.
         """
+        if self.group_runs_by_resources and self.memory_per_cpu is None:
+            logging.critical(
+                f"{self.__class__.__name__} has no default memory_per_cpu. "
+                f"Please set memory_per_cpu to group runs by resources."
+            )
         self.exp.build(write_to_disk=False)
 
         # Prepare job dir.
@@ -369,21 +561,27 @@ class SlurmEnvironment(Environment):
 
         self.job_dir.mkdir(parents=True, exist_ok=True)
 
-        prev_job_id = None
+        prev_job_ids = []
         for step in steps:
-            job_name = self._get_job_name(step)
-            job_file = self.job_dir / job_name
-            job_content = self._get_job(step, is_last=(step == steps[-1]))
-            tools.write_file(job_file, job_content)
-            prev_job_id = self._submit_job(job_file, dependency=prev_job_id)
-
-    def _get_job_params(self, step, is_last):
+            num_attempts = 1 + (self.max_retries if is_run_step(step) else 0)
+            for retry in range(num_attempts):
+                is_last = step == steps[-1] and retry == num_attempts - 1
+                job_ids = []
+                for job_name, job_content in self._get_jobs(step, is_last, retry):
+                    job_file = self.job_dir / job_name
+                    tools.write_file(job_file, job_content)
+                    job_ids.append(self._submit_job(job_file, dependency=prev_job_ids))
+                # Later jobs wait for all jobs of this step (or attempt).
+                prev_job_ids = job_ids
+
+    def _get_job_params(self, step, is_last, cpus_per_task=None, run_ids=None):
+        num_runs = None if run_ids is None else len(run_ids)
         job_params = {
             "errfile": "driver.err",
             "extra_options": self.extra_options,
             "logfile": "driver.log",
             "name": self._get_job_name(step),
-            "num_tasks": self._get_num_tasks(step),
+            "num_tasks": self._get_num_tasks(step, num_runs),
         }
 
         # Let all tasks write into the same two files. We could use %a
@@ -396,7 +594,7 @@ class SlurmEnvironment(Environment):
         job_params["qos"] = self.qos
         job_params["time_limit_per_task"] = self.time_limit_per_task
         job_params["memory_per_cpu"] = self.memory_per_cpu
-        job_params["cpus_per_task"] = self.cpus_per_task
+        job_params["cpus_per_task"] = cpus_per_task or self.cpus_per_task
         job_params["nice"] = self.NICE_VALUE if is_run_step(step) else 0
         job_params["environment_setup"] = self.setup
 
@@ -410,11 +608,18 @@ class SlurmEnvironment(Environment):
         return job_params
 
     def _submit_job(self, job_file, dependency=None):
+        """Submit *job_file* and return its job ID.
+
+        *dependency* may be a job ID or a list of job IDs. The job only
+        starts after all of these jobs have finished.
+
+        """
         submit = ["sbatch"]
         if self.export:
             submit += ["--export", ",".join(self.export)]
         if dependency:
-            submit.extend(["-d", "afterany:" + dependency, "--kill-on-invalid-dep=yes"])
+            job_ids = ":".join(tools.make_list(dependency))
+            submit.extend(["-d", "afterany:" + job_ids, "--kill-on-invalid-dep=yes"])
         submit.append(str(job_file))
         logging.info(f"Executing {' '.join(submit)}")
         out = subprocess.check_output(submit, cwd=self.job_dir).decode()
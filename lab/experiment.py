@@ -1,15 +1,19 @@
 """Main module for creating experiments."""
 
+import argparse
+import functools
 import logging
 import os
 import re
 import sys
+import tarfile
+import zipfile
 from collections import OrderedDict
 from pathlib import Path
 
-from lab import environments, tools
-from lab.fetcher import Fetcher
-from lab.parser import Parser
+from lab import environments, fetcher, tools
+from lab.calls import staging
+from lab.parser import ParseProfile, Parser, parse_run
 from lab.steps import Step, get_step, get_steps_text
 
 # How many tasks to group into one top-level directory.
@@ -29,9 +33,52 @@ steps_group.add_argument(
 steps_group.add_argument(
     "--all", dest="run_all_steps", action="store_true", help="Run all steps."
 )
+# Used internally by environments to parse runs right after they finish.
+ARGPARSER.add_argument(
+    "--parse-run-dir",
+    dest="parse_run_dirs",
+    action="append",
+    default=[],
+    help=argparse.SUPPRESS,
+)
+
+ARGPARSER.add_argument(
+    "--force-parse",
+    action="store_true",
+    help="Let the parse step parse all runs, including unchanged ones.",
+)
 
 STATIC_EXPERIMENT_PROPERTIES_FILENAME = "static-experiment-properties"
 STATIC_RUN_PROPERTIES_FILENAME = "static-properties"
+PARSE_FINGERPRINT_FILENAME = "parse-fingerprint"
+PARSE_PROFILE_FILENAME = "parse-profile.json"
+RESULTS_LOG_FILENAME = "results.jsonl"
+
+
+def _get_run_fingerprint(run_dir, parsers_fingerprint):
+    """Describe the parsers and the files in *run_dir* they may read."""
+    lines = [f"parsers: {parsers_fingerprint}"]
+    for entry in sorted(os.scandir(run_dir), key=lambda entry: entry.name):
+        if entry.name in ["properties", PARSE_FINGERPRINT_FILENAME]:
+            continue
+        try:
+            stat = entry.stat()
+        except FileNotFoundError:  # Broken symlink.
+            stat = entry.stat(follow_symlinks=False)
+        lines.append(f"{entry.name} {stat.st_size} {stat.st_mtime_ns}")
+    return "\n".join(lines) + "\n"
+
+
+def _write_zip_archive(run_dirs, path):
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as archive:
+        for run_dir in run_dirs:
+            for root, _, filenames in os.walk(run_dir):
+                for filename in sorted(filenames):
+                    file_path = Path(root) / filename
+                    if file_path.is_symlink():
+                        continue
+                    arcname = file_path.relative_to(run_dir.parent)
+                    archive.write(file_path, arcname.as_posix())
 
 
 def get_default_data_dir():
@@ -372,6 +419,7 @@ class Experiment(_Buildable):
         self.steps = []
         self.runs = []
         self.parsers = []
+        self._force_parse = False
 
         self.set_property("experiment_file", self._script)
 
@@ -444,40 +492,231 @@ class Experiment(_Buildable):
             raise TypeError(f'"{parser}" must be a Parser instance')
         self.parsers.append(parser)
 
-    def parse(self):
+    def parse(
+        self,
+        processes=1,
+        force=False,
+        threads=1,
+        profile=False,
+        compact=False,
+        results_log=False,
+    ):
         """
         Run all parsers that have been added to the experiment with
         :meth:`.add_parser`.
 
         After parsing, you'll want to run a "fetch" step to collect the parsed
         data from the experiment into the evaluation directory.
+
+        Lab stores a fingerprint of each parsed run in the file
+        "parse-fingerprint". It covers the names, sizes and modification
+        times of the files in the run directory and the patterns and
+        functions of all parsers. For parser functions, it covers their
+        code and the global functions and values of built-in types (e.g.,
+        lists and strings) that they use, but not imported modules or
+        classes. Runs whose fingerprint is unchanged since the last parse
+        step are skipped. This includes runs that were parsed right after
+        they finished (see *parse_after_run* in
+        :py:class:`~lab.environments.Environment`). Use *force=True* or
+        pass ``--force-parse`` on the command line to parse all runs
+        again, e.g., if a parser function reads files outside of the run
+        directory or if you changed code that it imports.
+
+        If *processes* is greater than 1, the run directories are parsed
+        by this many worker processes. The result is the same as for
+        sequential parsing. ::
+
+            exp.add_step("parse", exp.parse, processes=8)
+
+        If *threads* is greater than 1, the run directories are parsed by
+        this many threads instead. Threads are cheaper than processes and
+        pay off when parsing is dominated by file access, e.g., on network
+        file systems. Parser functions that are not added with
+        ``pass_run_dir=True`` (see :meth:`lab.parser.Parser.add_function`)
+        still run one at a time, since they change the working directory. ::
+
+            exp.add_step("parse", exp.parse, threads=16)
+
+        If *profile* is True, measure the wall-clock time and the number
+        of calls of each pattern search, parser function and file read,
+        summed over all parsed runs. Afterwards, log a table of these
+        tasks sorted by their total time and write it to the JSON file
+        "parse-profile.json" in the experiment directory.
+
+        If *compact* is True, the "properties" files are written without
+        indentation and key sorting, which is faster (see
+        :func:`lab.tools.pretty_print_properties`). This also applies to
+        runs parsed right after they finished.
+
+        If *results_log* is True, append the properties of each parsed
+        run, combined with its static properties and error logs as the
+        fetcher would combine them, as one line to the JSON Lines file
+        "results.jsonl" in its shard directory (e.g.,
+        "runs-00001-00100"). The fetcher then reads each shard log
+        sequentially instead of the files of the logged runs. It only
+        checks the sizes and modification times of these files, and
+        fetches runs whose files changed after they were logged from
+        their run dirs. Runs parsed
+        right after they finished are logged too, if the parse step
+        passes *results_log*. Concurrent appends are serialized by a file
+        lock. If *results_log* is False, the step removes existing
+        results logs, since they might be outdated afterwards. ::
+
+            exp.add_step("parse", exp.parse, results_log=True)
+
         """
 
         if not os.path.isdir(self.path):
             logging.critical(f"{self.path} is missing or not a directory")
 
-        run_dirs = sorted(Path(self.path).glob("runs-*-*/*"))
+        if not results_log:
+            for log_path in Path(self.path).glob(f"runs-*-*/{RESULTS_LOG_FILENAME}"):
+                log_path.unlink()
+        run_dirs = sorted(
+            path
+            for path in Path(self.path).glob("runs-*-*/*")
+            if path.name != RESULTS_LOG_FILENAME
+        )
         num_runs = len(run_dirs)
         logging.info(
             f"Running {len(self.parsers)} parsers in {num_runs:d} run directories."
         )
-        for index, run_dir in enumerate(run_dirs, start=1):
-            props_path = run_dir / "properties"
-            if props_path.is_file():
-                props_path.unlink()
-
+        parse_run_dir = functools.partial(
+            self._profile_run_dir if profile else self._parse_run_dir,
+            parsers_fingerprint=self._get_parsers_fingerprint(),
+            force=force or self._force_parse,
+            compact=compact,
+            results_log=results_log,
+        )
+        # Use large chunks to reduce the communication overhead, but create
+        # enough chunks for balancing the load between the workers.
+        chunksize = max(1, min(100, num_runs // (4 * processes)))
+        results = tools.map_parallel(
+            parse_run_dir,
+            run_dirs,
+            processes=processes,
+            chunksize=chunksize,
+            threads=threads,
+        )
+        num_skipped = 0
+        total_profile = ParseProfile()
+        for index, result in enumerate(results, start=1):
+            if profile:
+                parsed, run_profile = result
+                total_profile.update(run_profile)
+            else:
+                parsed = result
+            num_skipped += not parsed
             loglevel = logging.INFO if index % 100 == 0 else logging.DEBUG
-            logging.log(loglevel, f"Parsing run: {index:6d}/{num_runs:d}")
-            props = tools.Properties(filename=props_path)
-            for parser in self.parsers:
-                parser.parse(run_dir, props)
-            try:
-                props.write()
-            except ValueError as err:
-                logging.critical(
-                    f"Failed to write properties file in {run_dir}: {err}\n"
-                    "Often the solution is to revise a parser."
-                )
+            logging.log(loglevel, f"Parsed runs: {index:6d}/{num_runs:d}")
+        if num_skipped:
+            logging.info(f"Skipped {num_skipped} unchanged runs.")
+        if profile:
+            profile_path = Path(self.path) / PARSE_PROFILE_FILENAME
+            total_profile.write(profile_path)
+            logging.info(
+                f"Parse profile (also written to {profile_path}):\n"
+                f"{total_profile.get_table()}"
+            )
+
+    def _get_parsers_fingerprint(self):
+        return ",".join(parser._get_fingerprint() for parser in self.parsers)
+
+    def _profile_run_dir(self, run_dir, parsers_fingerprint, **kwargs):
+        profile = ParseProfile()
+        parsed = self._parse_run_dir(
+            run_dir, parsers_fingerprint, profile=profile, **kwargs
+        )
+        return parsed, profile
+
+    def _parse_run_dir(
+        self,
+        run_dir,
+        parsers_fingerprint,
+        force=False,
+        profile=None,
+        compact=False,
+        results_log=False,
+    ):
+        """Run all parsers in *run_dir* and write its "properties" file.
+
+        Return False if the run has already been parsed with the same
+        inputs and parsers and *force* is False.
+
+        """
+        props_path = run_dir / "properties"
+        fingerprint_path = run_dir / PARSE_FINGERPRINT_FILENAME
+        fingerprint = _get_run_fingerprint(run_dir, parsers_fingerprint)
+        if (
+            not force
+            and props_path.is_file()
+            and fingerprint_path.is_file()
+            and fingerprint_path.read_text() == fingerprint
+        ):
+            return False
+        for path in [props_path, fingerprint_path]:
+            if path.is_file():
+                path.unlink()
+
+        props = tools.Properties(filename=props_path, compact=compact)
+        parse_run(self.parsers, run_dir, props, profile)
+        try:
+            props.write()
+        except ValueError as err:
+            logging.critical(
+                f"Failed to write properties file in {run_dir}: {err}\n"
+                "Often the solution is to revise a parser."
+            )
+        fingerprint_path.write_text(fingerprint)
+        if results_log and props:
+            tools.append_json_line(
+                run_dir.parent / RESULTS_LOG_FILENAME,
+                fetcher.get_results_log_entry(run_dir),
+            )
+        return True
+
+    def _get_parse_step_kwargs(self):
+        for step in self.steps:
+            if step.func == self.parse:
+                return step.kwargs
+        return {}
+
+    def archive_runs(self, archive_format="zip"):
+        """
+        Pack each shard directory of parsed runs into a single archive.
+
+        Shard directories like "runs-00001-00100" contain many small
+        files. To save inodes, this step writes the contents of each
+        shard directory to "runs-00001-00100.zip" and removes the
+        directory afterwards. Shards with runs that have not been parsed
+        yet are skipped. The fetcher reads the runs from the archives
+        without extracting them. *archive_format* may be "zip" or
+        "tar". Zip archives are compressed but don't preserve symbolic
+        links. ::
+
+            exp.add_step("archive-runs", exp.archive_runs)
+
+        """
+        if archive_format not in ["zip", "tar"]:
+            logging.critical(f"Unknown archive format: {archive_format}")
+        for shard_dir in sorted(Path(self.path).glob("runs-*-*")):
+            if not shard_dir.is_dir():
+                continue
+            run_dirs = sorted(path for path in shard_dir.iterdir() if path.is_dir())
+            if not all((run_dir / "properties").is_file() for run_dir in run_dirs):
+                logging.info(f"Skipping {shard_dir.name} since it has unparsed runs.")
+                continue
+            archive_path = shard_dir.with_name(f"{shard_dir.name}.{archive_format}")
+            tmp_path = archive_path.with_name(f"{archive_path.name}.tmp")
+            if archive_format == "zip":
+                _write_zip_archive(run_dirs, tmp_path)
+            else:
+                with tarfile.open(tmp_path, "w") as tar:
+                    for run_dir in run_dirs:
+                        tar.add(run_dir, arcname=run_dir.name)
+            os.replace(tmp_path, archive_path)
+            tools.remove_path(shard_dir)
+            logging.info(f"Archived {len(run_dirs)} runs in {archive_path.name}")
 
     def add_fetcher(
         self, src=None, dest=None, merge=None, name=None, filter=None, **kwargs
@@ -490,7 +729,9 @@ class Experiment(_Buildable):
         experiments.
 
         *src* can be an experiment or evaluation directory or a properties
-        file. It defaults to ``exp.path``.
+        file. It defaults to ``exp.path``. You can also pass a list of
+        them to read all sources concurrently and write the combined
+        properties once.
 
         *dest* must be a new or existing evaluation directory. It
         defaults to ``exp.eval_dir``. If *dest* already contains
@@ -500,6 +741,16 @@ class Experiment(_Buildable):
         that the old data is merged or replaced (and the user will not
         be prompted).
 
+        When merging the runs of an experiment directory into *dest*,
+        only runs whose fetched files changed since the last fetch are
+        read again. Lab detects changes by the sizes and modification
+        times of these files, which it stores in the file
+        "fetch-index.json" in *dest*. Fetches with filters and fetches
+        from evaluation directories read all runs and delete the index.
+        Runs in the results logs written by the parse step (see
+        *results_log* in :meth:`.parse`) are taken from these logs
+        without reading their run directories.
+
         If no *name* is given, call this step "fetch-``basename(src)``".
 
         You can fetch only a subset of runs (e.g., runs for specific
@@ -525,11 +776,69 @@ class Experiment(_Buildable):
 
         >>> exp.add_fetcher(filter_algorithm=["algo_1", "algo_5"])
 
+        When fetching from an experiment directory, you can read the run
+        directories concurrently. Pass *threads* > 1 to hide the latency
+        of network file systems or *processes* > 1 to spread the JSON
+        decoding over multiple CPU cores. The fetched properties are the
+        same as for sequential fetching:
+
+        >>> exp.add_fetcher(name="fetch-threaded", threads=16)
+
+        If *database* is True, the combined properties are stored in the
+        SQLite database "properties.sqlite" instead of the JSON file
+        "properties". The run ID, domain, problem and algorithm of each
+        run are indexed, so reports that select runs with ``filter_domain``,
+        ``filter_problem`` or ``filter_algorithm`` only load the selected
+        runs:
+
+        >>> exp.add_fetcher(name="fetch-database", database=True)
+
+        If *compact* is True, the combined properties file is written
+        without indentation and key sorting, which is much faster for
+        big experiments. Use :func:`lab.tools.pretty_print_properties` to
+        inspect such files.
+
+        Pass *compression* ("xz", "gz" or "zst") to write the combined
+        properties file compressed, e.g., to "properties.zst", and
+        remove other variants of it. Without *compression*, an existing
+        compressed file keeps its format. *compression_level* selects
+        the compression level and uses the default of the format if
+        it's None. xz and zstd compress with max(*processes*, *threads*)
+        threads. For xz, this requires the ``xz`` program. zstd needs
+        Python 3.14 or the zstandard package:
+
+        >>> exp.add_fetcher(name="fetch-zstd", compression="zst", threads=8)
+
+        If *columns* is True, additionally export the combined properties
+        column by column to "properties-columns.npz" for fast analyses
+        that aggregate attributes over many runs, e.g., with pandas (see
+        :class:`lab.tools.ColumnarProperties`):
+
+        >>> exp.add_fetcher(name="fetch-columns", columns=True)
+
+        Runs from different sources must have different IDs. Pass
+        *conflicts* to resolve clashes instead of aborting: "first" keeps
+        the run from the source listed first, "newest" keeps the run
+        whose run directory, archive or properties file was modified
+        last, and "prefix" prepends the name of the source directory to
+        the IDs of all runs:
+
+        >>> exp.add_fetcher(
+        ...     src=["/path/to/exp1", "/path/to/exp2"],
+        ...     name="fetch-both",
+        ...     conflicts="prefix",
+        ... )
+
         """
         src = src or self.path
         dest = dest or self.eval_dir
-        name = name or f"fetch-{os.path.basename(src.rstrip('/'))}"
-        self.add_step(name, Fetcher(), src, dest, merge=merge, filter=filter, **kwargs)
+        src_names = [
+            os.path.basename(str(path).rstrip("/")) for path in tools.make_list(src)
+        ]
+        name = name or f"fetch-{'-'.join(src_names)}"
+        self.add_step(
+            name, fetcher.Fetcher(), src, dest, merge=merge, filter=filter, **kwargs
+        )
 
     def add_report(self, report, name="", eval_dir="", outfile=""):
         """Add *report* to the list of experiment steps.
@@ -573,6 +882,21 @@ class Experiment(_Buildable):
         """Parse the commandline and run selected steps."""
         ARGPARSER.epilog = get_steps_text(self.steps)
         args = ARGPARSER.parse_args()
+        if args.parse_run_dirs:
+            # The environment asks us to parse runs that just finished.
+            parsers_fingerprint = self._get_parsers_fingerprint()
+            # Write the properties like the parse step would.
+            parse_kwargs = self._get_parse_step_kwargs()
+            for run_dir in args.parse_run_dirs:
+                self._parse_run_dir(
+                    Path(run_dir),
+                    parsers_fingerprint,
+                    force=True,
+                    compact=parse_kwargs.get("compact", False),
+                    results_log=parse_kwargs.get("results_log", False),
+                )
+            return
+        self._force_parse = args.force_parse
         assert not args.steps or not args.run_all_steps
         if not args.steps and not args.run_all_steps:
             ARGPARSER.print_help()
@@ -674,11 +998,67 @@ class Run(_Buildable):
         # We need to build the run script before the resources, because
         # the run script is added as a resource.
         self._build_run_script()
+        if self._uses_staging():
+            self.add_new_file(
+                "",
+                staging.MANIFEST_FILENAME,
+                staging.format_manifest(self._get_staging_entries()),
+            )
         self._build_new_files()
         self._build_resources()
         self._check_id()
         self._build_properties_file(STATIC_RUN_PROPERTIES_FILENAME)
 
+    def _uses_staging(self):
+        return bool(getattr(self.experiment.environment, "staging_dir", None))
+
+    def _get_staging_entries(self):
+        """Return the entries of the run's staging manifest.
+
+        Only declared resources are staged: the top-level entries of the
+        experiment dir that hold experiment resources (e.g., cached
+        revisions) and the directories containing the sources of
+        symlinked resources (e.g., benchmark files).
+
+        """
+        exp_path = self.experiment.path
+        entries = []
+
+        def add_entry(dest, staged_path, src, copy_dest):
+            # Commands may reference the resource by its absolute path or
+            # by its path relative to the run dir.
+            for arg_path in [dest, os.path.relpath(dest, self.path)]:
+                entries.append((arg_path, staged_path, src, copy_dest))
+
+        for owner in [self.experiment, self]:
+            for resource in owner.resources:
+                dest = owner._get_abs_path(resource.dest)
+                if not dest.startswith(exp_path) or dest == exp_path:
+                    continue
+                if resource.symlink:
+                    source = os.path.abspath(resource.source)
+                    src = source if os.path.isdir(source) else os.path.dirname(source)
+                    if os.path.commonpath([src, exp_path]) in [src, exp_path]:
+                        # Don't copy the experiment dir or parts of it.
+                        continue
+                    add_entry(
+                        dest,
+                        os.path.join("external", source.lstrip(os.sep)),
+                        src,
+                        os.path.join("external", src.lstrip(os.sep)),
+                    )
+                elif owner is self.experiment:
+                    # Never stage run dirs since runs write to them.
+                    rel_dest = os.path.relpath(dest, exp_path)
+                    top_level = rel_dest.split(os.sep)[0]
+                    add_entry(
+                        dest,
+                        os.path.join("exp", rel_dest),
+                        os.path.join(exp_path, top_level),
+                        os.path.join("exp", top_level),
+                    )
+        return list(dict.fromkeys(entries))
+
     def _build_run_script(self):
         if not self.commands:
             logging.critical("Please add at least one command")
@@ -713,6 +1093,8 @@ class Run(_Buildable):
                 return f"{key}={formatted_value}"
 
             cmd_string = f"[{', '.join([format_arg(arg) for arg in cmd])}]"
+            if self._uses_staging():
+                cmd_string = f"stage_args_from_environment({cmd_string})"
             kwargs_string = ", ".join(
                 format_key_value_pair(key, value)
                 for key, value in sorted(kwargs.items())
@@ -726,6 +1108,12 @@ class Run(_Buildable):
             make_call(name, cmd, kwargs)
             for name, (cmd, kwargs) in self.commands.items()
         )
+        if self._uses_staging():
+            # Use the node-local copies that the Slurm job has staged.
+            calls_text = (
+                "from lab.calls.staging import stage_args_from_environment\n\n"
+                + calls_text
+            )
         run_script = tools.fill_template("run.py", calls=calls_text)
 
         self.add_new_file("", "run", run_script, permissions=0o755)
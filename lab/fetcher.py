@@ -1,10 +1,309 @@
+import functools
+import hashlib
+import json
 import logging
+import os
 import sys
+import tarfile
+import zipfile
 from pathlib import Path
 
 import lab.experiment
 from lab import tools
 
+FETCH_INDEX_FILENAME = "fetch-index.json"
+# Suffixes of archived run shards, see Experiment.archive_runs().
+SHARD_ARCHIVE_SUFFIXES = (".zip", ".tar")
+# Ways of handling runs with the same ID from different sources.
+CONFLICT_POLICIES = ("error", "first", "newest", "prefix")
+# Number of bytes at the start and end of error logs that are stored in the
+# properties. The bytes in between are omitted.
+ERROR_LOG_HEAD_SIZE = 8 * 1024
+ERROR_LOG_TAIL_SIZE = 8 * 1024
+_ERROR_LOG_BLOCK_SIZE = 1024 * 1024
+
+
+def _get_run_files_fingerprint(run_dir):
+    """Describe the files in *run_dir* that the fetcher reads."""
+    parts = []
+    for name in [
+        lab.experiment.STATIC_RUN_PROPERTIES_FILENAME,
+        "properties",
+        "driver.log",
+        "driver.err",
+        "run.err",
+    ]:
+        try:
+            stat = (run_dir / name).stat()
+        except FileNotFoundError:
+            parts.append(f"{name} missing")
+        else:
+            parts.append(f"{name} {stat.st_size} {stat.st_mtime_ns}")
+    return ", ".join(parts)
+
+
+def _get_run_fingerprint(run_dir, slurm_err):
+    return f"slurm.err: {slurm_err}, {_get_run_files_fingerprint(run_dir)}"
+
+
+def get_results_log_entry(run_dir):
+    """Return the line for *run_dir* in the results log of its shard.
+
+    The entry contains the fingerprint of the fetched files, so that the
+    fetcher can detect outdated entries.
+    """
+    fingerprint = _get_run_files_fingerprint(run_dir)
+    return {
+        "run_dir": run_dir.name,
+        "fingerprint": fingerprint,
+        "properties": Fetcher().fetch_dir(run_dir),
+    }
+
+
+def _load_index(path, conflicts):
+    """Load the run entries of the fetch index at *path*.
+
+    The run IDs in the index depend on the conflict policy, so the index
+    is only valid for fetches with the policy it was written with.
+    """
+    try:
+        with open(path) as f:
+            index = json.load(f)
+    except FileNotFoundError:
+        return {}
+    except ValueError as err:
+        logging.warning(f"Ignoring invalid fetch index {path}: {err}")
+        return {}
+    if not isinstance(index, dict) or index.get("conflicts") != conflicts:
+        logging.info("Ignoring fetch index written with another conflict policy")
+        return {}
+    return index["runs"]
+
+
+def _write_index(path, index, conflicts):
+    tmp_path = path.with_name(path.name + ".tmp")
+    with open(tmp_path, "w") as f:
+        json.dump(
+            {"conflicts": conflicts, "runs": index},
+            f,
+            separators=(",", ":"),
+            sort_keys=True,
+        )
+    os.replace(tmp_path, path)
+
+
+class _RunDirFiles:
+    """Read the files of a run directory."""
+
+    def __init__(self, run_dir):
+        self.run_dir = Path(run_dir)
+
+    def get_path(self, name):
+        return tools.get_relative_path(self.run_dir / name)
+
+    def exists(self, name):
+        return (self.run_dir / name).exists()
+
+    def open(self, name):
+        return open(self.run_dir / name, "rb")
+
+    def load_properties(self, name):
+        return tools.Properties(filename=self.run_dir / name)
+
+
+class _ShardArchive:
+    """Read files of archived runs without extracting the archive.
+
+    Zip and tar archives store the offsets of their members, so each file
+    can be read directly.
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        if self.path.suffix == ".zip":
+            self._zip = zipfile.ZipFile(self.path)
+            self._tar = None
+            self._names = set(self._zip.namelist())
+        else:
+            self._zip = None
+            self._tar = tarfile.open(self.path)
+            self._members = {
+                member.name: member
+                for member in self._tar.getmembers()
+                if member.isfile()
+            }
+            self._names = set(self._members)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_exc):
+        (self._zip or self._tar).close()
+
+    def get_run_names(self):
+        """Return the sorted names of the run dirs in the archive."""
+        return sorted({name.split("/")[0] for name in self._names if "/" in name})
+
+    def exists(self, name):
+        return name in self._names
+
+    def open(self, name):
+        if self._zip:
+            return self._zip.open(name)
+        else:
+            return self._tar.extractfile(self._members[name])
+
+    def read_text(self, name):
+        with self.open(name) as f:
+            return f.read().decode(tools.DEFAULT_ENCODING)
+
+
+class _ArchivedRunFiles:
+    """Read the files of a run in a shard archive."""
+
+    def __init__(self, archive, run_name):
+        self.archive = archive
+        self.run_name = run_name
+
+    def get_path(self, name):
+        path = tools.get_relative_path(self.archive.path)
+        return f"{path}:{self.run_name}/{name}"
+
+    def exists(self, name):
+        return self.archive.exists(f"{self.run_name}/{name}")
+
+    def read_text(self, name):
+        return self.archive.read_text(f"{self.run_name}/{name}")
+
+    def open(self, name):
+        return self.archive.open(f"{self.run_name}/{name}")
+
+    def load_properties(self, name):
+        props = tools.Properties()
+        if self.exists(name):
+            try:
+                props.update(tools.json.loads(self.read_text(name), allow_nan=True))
+            except ValueError as e:
+                logging.critical(f"JSON parse error in '{self.get_path(name)}': {e}")
+        return props
+
+
+def _read_error_log(f):
+    """Return the content of the binary error log *f* or an excerpt of it.
+
+    For big logs, only keep the head and tail and note the size and SHA-1
+    digest of the full log. The log is read block by block, so memory
+    usage is bounded.
+    """
+    digest = hashlib.sha1()
+    head = f.read(ERROR_LOG_HEAD_SIZE)
+    digest.update(head)
+    size = len(head)
+    tail = b""
+    while block := f.read(_ERROR_LOG_BLOCK_SIZE):
+        digest.update(block)
+        size += len(block)
+        tail = (tail + block)[-ERROR_LOG_TAIL_SIZE:]
+    omitted = size - len(head) - len(tail)
+    if omitted == 0:
+        return tools.get_string(head + tail)
+    return (
+        f"{tools.get_string(head)}\n"
+        f"[... {omitted} bytes omitted, full log has {size} bytes and SHA-1 "
+        f"{digest.hexdigest()} ...]\n"
+        f"{tools.get_string(tail)}"
+    )
+
+
+def _read_results_log(path):
+    """Map the run dir names in a results log to their latest entries.
+
+    See *results_log* in :meth:`lab.experiment.Experiment.parse`. Invalid
+    lines, e.g., from interrupted writes, are skipped, so these runs are
+    fetched from their run dirs.
+    """
+    runs = {}
+    with open(path, "rb") as f:
+        for line_number, line in enumerate(f, start=1):
+            try:
+                entry = tools.json.loads(line, allow_nan=True)
+                runs[entry["run_dir"]] = (
+                    entry.get("fingerprint"),
+                    entry["properties"],
+                )
+            except (ValueError, KeyError, TypeError) as err:
+                logging.warning(
+                    f"Skipping invalid line {line_number} of "
+                    f"{tools.get_relative_path(path)}: {err}"
+                )
+    return runs
+
+
+def _get_shard_archives(src_dir):
+    """Return the archived shards in *src_dir* whose directory is gone."""
+    archives = []
+    for suffix in SHARD_ARCHIVE_SUFFIXES:
+        for path in src_dir.glob(f"runs-*-*{suffix}"):
+            if path.with_suffix("").is_dir():
+                logging.warning(
+                    f"Ignoring {tools.get_relative_path(path)} since the shard "
+                    f"directory still exists."
+                )
+            else:
+                archives.append(path)
+    return sorted(archives)
+
+
+class _Source:
+    """An experiment dir, eval dir or properties file to fetch runs from."""
+
+    def __init__(self, path):
+        self.path = path
+        self.name = (path if path.is_dir() else path.parent).name
+        self.props_file = None
+        self.slurm_err = False
+        for props_file in [
+            path / "properties",
+            *[path / f"properties{suffix}" for suffix in tools.COMPRESSION_SUFFIXES],
+            path / tools.PROPERTIES_DATABASE_FILENAME,
+            path,
+        ]:
+            if props_file.is_file():
+                self.props_file = props_file
+                break
+        if not self.props_file:
+            try:
+                slurm_err_content = tools.get_slurm_err_content(path)
+            except FileNotFoundError:
+                slurm_err_content = ""
+            if slurm_err_content:
+                logging.warning("There was output to *-grid-steps/slurm.err")
+            self.slurm_err = bool(slurm_err_content)
+
+
+class _FetchedRun:
+    def __init__(
+        self, source_index, id, props, mtime, index_key=None, index_entry=None
+    ):
+        self.source_index = source_index
+        self.id = id
+        # None if the run is unchanged since the last fetch.
+        self.props = props
+        self.mtime = mtime
+        self.index_key = index_key
+        self.index_entry = index_entry
+
+
+def _load_properties(path):
+    """Load a properties file or database."""
+    if path.suffix == ".sqlite":
+        return tools.PropertiesDatabase(path).load()
+    return tools.Properties(filename=path)
+
+
+def _add_id_prefix(props, prefix):
+    props["id"] = [prefix, *props["id"]]
+
 
 def _check_eval_dir(eval_dir: Path):
     if eval_dir.exists():
@@ -45,20 +344,29 @@ class Fetcher:
 
     def fetch_dir(self, run_dir):
         """Combine "static-properties" and "properties" from a run dir and return it."""
-        run_dir = Path(run_dir)
-        static_props = tools.Properties(
-            filename=run_dir / lab.experiment.STATIC_RUN_PROPERTIES_FILENAME
+        return self._fetch_run(_RunDirFiles(run_dir))
+
+    def fetch_archive(self, path):
+        """Return the combined properties of all runs in a shard archive."""
+        with _ShardArchive(path) as archive:
+            return [
+                self._fetch_run(_ArchivedRunFiles(archive, run_name))
+                for run_name in archive.get_run_names()
+            ]
+
+    def _fetch_run(self, files):
+        static_props = files.load_properties(
+            lab.experiment.STATIC_RUN_PROPERTIES_FILENAME
         )
-        dynamic_props_path = run_dir / "properties"
-        dynamic_props = tools.Properties(filename=dynamic_props_path)
-        if not dynamic_props_path.exists():
+        dynamic_props = files.load_properties("properties")
+        if not files.exists("properties"):
             logging.critical(
-                f'Properties file "{tools.get_relative_path(dynamic_props_path)}" is'
+                f'Properties file "{files.get_path("properties")}" is'
                 f' missing. Did you forget to add or run the "parse" step?'
             )
         elif not dynamic_props:
             logging.critical(
-                f'Properties file "{tools.get_relative_path(dynamic_props_path)}" is'
+                f'Properties file "{files.get_path("properties")}" is'
                 f" empty. Have you added at least one parser?"
             )
 
@@ -66,28 +374,129 @@ class Fetcher:
         props.update(static_props)
         props.update(dynamic_props)
 
-        driver_log = run_dir / "driver.log"
-        if not driver_log.exists():
+        if not files.exists("driver.log"):
             props.add_unexplained_error(
                 "driver.log is missing. Probably the run was never started."
             )
 
-        driver_err = run_dir / "driver.err"
-        run_err = run_dir / "run.err"
-        for logfile in [driver_err, run_err]:
-            if logfile.exists():
-                content = logfile.read_text()
+        for logfile in ["driver.err", "run.err"]:
+            if files.exists(logfile):
+                with files.open(logfile) as f:
+                    content = _read_error_log(f)
                 if content:
-                    props.add_unexplained_error(f"{logfile.name}: {content}")
+                    props.add_unexplained_error(f"{logfile}: {content}")
         return props
 
-    def __call__(self, src_dir, eval_dir=None, merge=None, filter=None, **kwargs):
+    def _fetch_logged_runs(self, source_index, source, prefix):
+        """Return the runs in the results logs of *source* by run dir.
+
+        Entries are skipped if the files of their run dir changed after
+        they were logged, e.g., because the run was parsed again without
+        *results_log*.
         """
-        Copy properties from an exp-dir or eval-dir into an eval-dir.
+        logged_runs = {}
+        log_name = lab.experiment.RESULTS_LOG_FILENAME
+        for log_path in sorted(source.path.glob(f"runs-*-*/{log_name}")):
+            mtime = log_path.stat().st_mtime
+            for run_name, (fingerprint, props) in _read_results_log(log_path).items():
+                run_dir = log_path.parent / run_name
+                if fingerprint != _get_run_files_fingerprint(run_dir):
+                    continue
+                if source.slurm_err:
+                    tools.add_unexplained_error(props, "output-to-slurm.err")
+                if prefix:
+                    _add_id_prefix(props, source.name)
+                run_id = "-".join(props["id"])
+                logged_runs[run_dir] = _FetchedRun(source_index, run_id, props, mtime)
+        return logged_runs
+
+    def _fetch_changed_dir(self, run_dir, index, combined_props, slurm_err):
+        """Fetch *run_dir* unless it is unchanged since the last fetch.
+
+        Return the index key and entry of the run and its properties, or
+        None if the properties in *combined_props* are still up to date.
+
+        """
+        key = os.path.abspath(run_dir)
+        fingerprint = _get_run_fingerprint(run_dir, slurm_err)
+        entry = index.get(key)
+        if (
+            entry is not None
+            and entry["fingerprint"] == fingerprint
+            and entry["id"] in combined_props
+        ):
+            return key, entry, None
+        props = self.fetch_dir(run_dir)
+        if slurm_err:
+            props.add_unexplained_error("output-to-slurm.err")
+        entry = {"id": "-".join(props["id"]), "fingerprint": fingerprint}
+        return key, entry, props
+
+    def _fetch_task(self, task, sources, index, combined_props, prefix):
+        """Fetch the runs of a run dir, shard archive or properties file.
+
+        Return a list of :class:`_FetchedRun` objects.
+
+        """
+        kind, source_index, path = task
+        source = sources[source_index]
+        mtime = path.stat().st_mtime
+        if kind == "dir":
+            key, entry, props = self._fetch_changed_dir(
+                path, index, combined_props, source.slurm_err
+            )
+            if props is not None and prefix:
+                _add_id_prefix(props, source.name)
+                entry["id"] = "-".join(props["id"])
+            return [_FetchedRun(source_index, entry["id"], props, mtime, key, entry)]
+        if kind == "archive":
+            runs = []
+            for props in self.fetch_archive(path):
+                if source.slurm_err:
+                    props.add_unexplained_error("output-to-slurm.err")
+                if prefix:
+                    _add_id_prefix(props, source.name)
+                runs.append(("-".join(props["id"]), props))
+        else:
+            src_props = _load_properties(path)
+            if not src_props:
+                logging.critical(f"No properties found in {source.path}")
+            # Keep the run IDs of eval dirs, since their runs may lack an
+            # "id" attribute (see examples/report-external-results.py).
+            runs = []
+            for run_id, props in src_props.items():
+                if prefix:
+                    run_id = f"{source.name}-{run_id}"
+                    if "id" in props:
+                        _add_id_prefix(props, source.name)
+                runs.append((run_id, props))
+        return [
+            _FetchedRun(source_index, run_id, props, mtime) for run_id, props in runs
+        ]
+
+    def __call__(
+        self,
+        src_dir,
+        eval_dir=None,
+        merge=None,
+        filter=None,
+        processes=1,
+        threads=1,
+        conflicts="error",
+        database=False,
+        columns=False,
+        compact=False,
+        compression=None,
+        compression_level=None,
+        **kwargs,
+    ):
+        """
+        Copy properties from exp-dirs or eval-dirs into an eval-dir.
 
         If the destination eval-dir already exist, the data will be merged. This
-        means *src_dir* can be an exp-dir, an eval-dir or a properties file, and
-        *eval_dir* can be a new or existing destination directory.
+        means *src_dir* can be an exp-dir, an eval-dir or a properties file, or a
+        list of them, and *eval_dir* can be a new or existing destination
+        directory.
 
         We recommend using lab.Experiment.add_fetcher() to add fetchers to an
         experiment. See the method's documentation for a description of the
@@ -97,14 +506,27 @@ class Fetcher:
         # Configure logging here so that logging.critical() aborts the program
         # even when a fetcher is run without constructing an Experiment.
         tools.configure_logging()
-        src_dir = Path(src_dir)
-        if not src_dir.exists():
-            logging.critical(f"{src_dir} is missing")
+        if conflicts not in CONFLICT_POLICIES:
+            logging.critical(
+                f"conflicts must be one of {CONFLICT_POLICIES}, not {conflicts!r}"
+            )
+        if compression and f".{compression}" not in tools.COMPRESSION_SUFFIXES:
+            logging.critical(f"Unknown compression format: {compression!r}")
+        src_dirs = [Path(path) for path in tools.make_list(src_dir)]
+        if not src_dirs:
+            logging.critical("No source directory given")
+        for path in src_dirs:
+            if not path.exists():
+                logging.critical(f"{path} is missing")
 
-        eval_dir = eval_dir or str(src_dir).rstrip("/") + "-eval"
+        if not eval_dir:
+            if len(src_dirs) > 1:
+                logging.critical("Fetching from multiple sources needs an eval_dir")
+            eval_dir = str(src_dirs[0]).rstrip("/") + "-eval"
         eval_dir = Path(eval_dir)
+        src_names = ", ".join(str(tools.get_relative_path(path)) for path in src_dirs)
         logging.info(
-            f"Fetching properties from {tools.get_relative_path(src_dir)} "
+            f"Fetching properties from {src_names} "
             f"to {tools.get_relative_path(eval_dir)}"
         )
 
@@ -116,47 +538,114 @@ class Fetcher:
         else:
             tools.remove_path(eval_dir)
 
-        # Load properties in the eval_dir if there are any already.
-        src_props_file = src_dir / "properties"
-        for path in [src_dir / "properties.xz", src_dir]:
-            if not src_props_file.is_file() and path.is_file():
-                src_props_file = path
-                break
-        fetch_from_eval_dir = src_props_file.exists()
+        sources = [_Source(path) for path in src_dirs]
         combined_props = tools.Properties(eval_dir / "properties")
+        database_path = eval_dir / tools.PROPERTIES_DATABASE_FILENAME
+        if database_path.exists() and not combined_props:
+            combined_props.update(tools.PropertiesDatabase(database_path).load())
         run_filter = tools.RunFilter(filter, **kwargs)
-        if fetch_from_eval_dir:
-            src_props = tools.Properties(filename=src_props_file)
-            if not src_props:
-                logging.critical(f"No properties found in {src_dir}")
-            run_filter.apply(src_props)
-            combined_props.update(src_props)
-            logging.info(f"Fetched properties of {len(src_props)} runs.")
-        else:
-            try:
-                slurm_err_content = tools.get_slurm_err_content(src_dir)
-            except FileNotFoundError:
-                slurm_err_content = ""
+        # The fetch index maps run dirs to the run IDs and fingerprints of
+        # the runs in the combined properties. Filters may drop or change
+        # runs, eval dirs may overwrite runs and "first" and "newest" may
+        # pick other runs than the last time, so we can only reuse the
+        # combined properties of unchanged runs without all of these.
+        # Fetches that don't update the index invalidate it. Since the
+        # run IDs depend on the conflict policy, changing it invalidates
+        # the index as well.
+        index_path = eval_dir / FETCH_INDEX_FILENAME
+        use_index = (
+            not run_filter.filters
+            and not any(source.props_file for source in sources)
+            and (len(sources) == 1 or conflicts in ["error", "prefix"])
+        )
+        fetch_index = _load_index(index_path, conflicts) if use_index else {}
 
-            if slurm_err_content:
-                logging.warning("There was output to *-grid-steps/slurm.err")
+        tasks = []
+        # Runs taken from the results logs written by the parse step.
+        logged_runs = []
+        for source_index, source in enumerate(sources):
+            if source.props_file:
+                tasks.append(("eval", source_index, source.props_file))
+                continue
+            run_dirs = sorted(
+                path
+                for path in source.path.glob("runs-*-*/*")
+                if path.name != lab.experiment.RESULTS_LOG_FILENAME
+            )
+            archives = _get_shard_archives(source.path)
+            source_logged_runs = self._fetch_logged_runs(
+                source_index, source, prefix=conflicts == "prefix"
+            )
+            num_logged = 0
+            for run_dir in run_dirs:
+                if run_dir in source_logged_runs:
+                    logged_runs.append(source_logged_runs[run_dir])
+                    num_logged += 1
+                else:
+                    tasks.append(("dir", source_index, run_dir))
+            logging.info(
+                f"Collecting properties from {len(run_dirs):d} run directories "
+                f"({num_logged} in results logs) and {len(archives)} archives "
+                f"in {source.name}"
+            )
+            tasks.extend(("archive", source_index, path) for path in archives)
 
-            new_props = tools.Properties()
-            run_dirs = sorted(src_dir.glob("runs-*-*/*"))
-            num_dirs = len(run_dirs)
-            logging.info(f"Collecting properties from {num_dirs:d} run directories")
-            for index, run_dir in enumerate(run_dirs, start=1):
-                props = self.fetch_dir(run_dir)
-                if slurm_err_content:
-                    props.add_unexplained_error("output-to-slurm.err")
-                id_string = "-".join(props["id"])
-                new_props[id_string] = props
-                loglevel = logging.INFO if index % 100 == 0 else logging.DEBUG
-                logging.log(
-                    loglevel, f"Collected {index:6d}/{num_dirs} properties files"
-                )
-            run_filter.apply(new_props)
-            combined_props.update(new_props)
+        fetch_task = functools.partial(
+            self._fetch_task,
+            sources=sources,
+            index=fetch_index,
+            combined_props=combined_props,
+            prefix=conflicts == "prefix",
+        )
+        # Use large chunks to reduce the communication overhead, but create
+        # enough chunks for balancing the load between the workers.
+        chunksize = max(1, min(100, len(tasks) // (4 * processes)))
+        results = tools.map_parallel(
+            fetch_task,
+            tasks,
+            processes=processes,
+            chunksize=chunksize,
+            threads=threads,
+        )
+        selected_runs = {}
+        for run in logged_runs:
+            if self._keep_run(run, selected_runs, sources, conflicts):
+                selected_runs[run.id] = run
+        new_index = {}
+        for task_index, fetched_runs in enumerate(results, start=1):
+            for run in fetched_runs:
+                if run.index_key:
+                    new_index[run.index_key] = run.index_entry
+                if self._keep_run(run, selected_runs, sources, conflicts):
+                    selected_runs[run.id] = run
+            loglevel = logging.INFO if task_index % 100 == 0 else logging.DEBUG
+            logging.log(loglevel, f"Collected {task_index:6d}/{len(tasks)} sources")
+
+        new_props = tools.Properties()
+        num_unchanged = 0
+        for run_id, run in selected_runs.items():
+            if run.props is None:
+                num_unchanged += 1
+            else:
+                new_props[run_id] = run.props
+        if num_unchanged:
+            logging.info(f"Kept properties of {num_unchanged} unchanged runs.")
+        run_filter.apply(new_props)
+        combined_props.update(new_props)
+        logging.info(f"Fetched properties of {len(new_props)} runs.")
+        if use_index:
+            # Keep the entries of runs from other experiments, but drop
+            # those of run dirs that no longer exist, e.g., because they
+            # have been archived.
+            src_prefixes = tuple(
+                os.path.join(os.path.abspath(source.path), "") for source in sources
+            )
+            fetch_index = {
+                key: entry
+                for key, entry in fetch_index.items()
+                if not key.startswith(src_prefixes)
+            }
+            fetch_index.update(new_index)
 
         unexplained_errors = 0
         for props in combined_props.values():
@@ -164,9 +653,52 @@ class Fetcher:
                 unexplained_errors += 1
 
         tools.makedirs(eval_dir)
-        combined_props.write()
+        # Only keep the requested format to avoid reading outdated data later.
+        if database:
+            tools.PropertiesDatabase(database_path).write(combined_props)
+            tools.remove_path(combined_props.path)
+        else:
+            if compression:
+                compressed_path = eval_dir / f"properties.{compression}"
+                if combined_props.path != compressed_path:
+                    # Only one variant of the properties file may exist.
+                    tools.remove_path(combined_props.path)
+                    combined_props.path = compressed_path
+            combined_props.compact = compact
+            combined_props.compression_level = compression_level
+            # Use the parallelism granted for fetching for compressing too.
+            combined_props.compression_threads = max(processes, threads)
+            combined_props.write()
+            tools.remove_path(database_path)
+        columns_path = eval_dir / tools.COLUMNS_FILENAME
+        if columns:
+            tools.ColumnarProperties.write(combined_props, columns_path)
+        else:
+            # Don't leave an outdated export behind.
+            tools.remove_path(columns_path)
+        if fetch_index:
+            _write_index(index_path, fetch_index, conflicts)
+        elif index_path.exists():
+            index_path.unlink()
         func = logging.info if unexplained_errors == 0 else logging.warning
+        kind = "database" if database else "file"
         func(
-            f"Wrote properties file. It contains {unexplained_errors} "
+            f"Wrote properties {kind}. It contains {unexplained_errors} "
             f"runs with unexplained errors."
         )
+
+    @staticmethod
+    def _keep_run(run, selected_runs, sources, conflicts):
+        """Return True if *run* should replace the selected run with its ID."""
+        other = selected_runs.get(run.id)
+        if other is None or other.source_index == run.source_index:
+            return True
+        if conflicts == "first":
+            return False
+        if conflicts == "newest":
+            return run.mtime > other.mtime
+        logging.critical(
+            f'Run ID "{run.id}" occurs in {sources[other.source_index].path} and '
+            f'{sources[run.source_index].path}. Use conflicts="first", '
+            f'"newest" or "prefix" to resolve such conflicts.'
+        )
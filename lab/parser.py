@@ -19,14 +19,122 @@ Parsers are run in the order in which they were added.
 
 """
 
+import contextlib
+import hashlib
+import io
+import json
 import logging
+import mmap
 import os
 import re
-from collections import defaultdict
+import shutil
+import tempfile
+import threading
+import time
+from collections import defaultdict, deque
 from pathlib import Path
 
 from lab import tools
 
+MATCH_MODES = ("first", "last", "all")
+# Size of the first block at the end of a file that is searched for the last
+# match of a pattern. If there is no match, the block size is quadrupled.
+LAST_MATCH_BLOCK_SIZE = 64 * 1024
+# Size of the blocks in which compressed files are decompressed for mmap.
+DECOMPRESSION_BLOCK_SIZE = 1024 * 1024
+# The working directory is shared by all threads, so functions that are
+# run in the run directory must not be called concurrently.
+_CHDIR_LOCK = threading.Lock()
+
+
+def _get_const_fingerprint(const):
+    if hasattr(const, "co_code"):
+        return _get_code_fingerprint(const)
+    if isinstance(const, set | frozenset):
+        # Avoid depending on the hash seed, e.g., for "x in {'a', 'b'}".
+        return repr(sorted(repr(item) for item in const))
+    return repr(const)
+
+
+def _get_code_fingerprint(code):
+    """Return a string that changes whenever the code object changes."""
+    consts = [_get_const_fingerprint(const) for const in code.co_consts]
+    return repr((code.co_code, code.co_names, code.co_varnames, consts))
+
+
+def _get_names(code):
+    """Return the names of globals and attributes used in *code*."""
+    names = set(code.co_names)
+    for const in code.co_consts:
+        if hasattr(const, "co_code"):
+            names |= _get_names(const)
+    return names
+
+
+# Global values of these types are part of parser function fingerprints.
+_FINGERPRINTED_GLOBAL_TYPES = (
+    bool,
+    bytes,
+    dict,
+    float,
+    frozenset,
+    int,
+    list,
+    re.Pattern,
+    set,
+    str,
+    tuple,
+    type(None),
+)
+
+
+def _get_globals_fingerprint(function, seen):
+    """Return a string describing the globals that *function* uses.
+
+    Global functions (e.g., helpers defined next to a parser function)
+    are described recursively. Values of built-in types (e.g., a list
+    of known domains) are described by repr(). Other objects, including
+    classes and modules, are ignored.
+    """
+    used_globals = []
+    for name in sorted(_get_names(function.__code__)):
+        if name not in function.__globals__:
+            continue
+        value = function.__globals__[name]
+        if getattr(value, "__code__", None) is not None:
+            if value.__code__ not in seen:
+                used_globals.append((name, _get_callable_fingerprint(value, seen)))
+        elif isinstance(value, _FINGERPRINTED_GLOBAL_TYPES):
+            used_globals.append((name, _get_const_fingerprint(value)))
+    return repr(used_globals)
+
+
+def _get_callable_fingerprint(function, seen=None):
+    """Return a string describing the name, code, defaults and closure.
+
+    The globals used by *function* are included as described in
+    :func:`_get_globals_fingerprint`. Changes to other code, e.g., to
+    imported modules or classes, go unnoticed. For callables without
+    code object, fall back to repr(), which may contain memory addresses
+    and then never matches in later parse steps.
+    """
+    code = getattr(function, "__code__", None)
+    if code is None:
+        return repr(function)
+    seen = set() if seen is None else seen
+    seen.add(code)
+    closure = [repr(cell.cell_contents) for cell in function.__closure__ or []]
+    return repr(
+        (
+            function.__module__,
+            function.__qualname__,
+            _get_code_fingerprint(code),
+            repr(function.__defaults__),
+            closure,
+            _get_globals_fingerprint(function, seen),
+        )
+    )
+
 
 def _get_pattern_flags(s):
     flags = 0
@@ -38,36 +146,176 @@ def _get_pattern_flags(s):
     return flags
 
 
+class ParseProfile:
+    """Accumulate wall-clock times and call counts of parsing tasks.
+
+    Tasks are pattern searches (keyed by file and regex), parser
+    functions and file reads. Profiles can be pickled, so worker
+    processes can send them to the main process, which merges them with
+    :meth:`update`.
+
+    """
+
+    def __init__(self):
+        # Map task names to [calls, seconds].
+        self.stats = {}
+
+    @contextlib.contextmanager
+    def measure(self, task):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            entry = self.stats.setdefault(task, [0, 0.0])
+            entry[0] += 1
+            entry[1] += time.perf_counter() - start
+
+    def update(self, other):
+        for task, (calls, seconds) in other.stats.items():
+            entry = self.stats.setdefault(task, [0, 0.0])
+            entry[0] += calls
+            entry[1] += seconds
+
+    def _get_sorted_stats(self):
+        return sorted(self.stats.items(), key=lambda item: (-item[1][1], item[0]))
+
+    def get_table(self):
+        """Return a table of all tasks sorted by their total time."""
+        lines = [f"{'time (s)':>10} {'calls':>8} {'ms/call':>8}  task"]
+        for task, (calls, seconds) in self._get_sorted_stats():
+            lines.append(
+                f"{seconds:10.3f} {calls:8d} {1000 * seconds / calls:8.3f}  {task}"
+            )
+        return "\n".join(lines)
+
+    def write(self, path):
+        """Write the stats sorted by total time to the JSON file *path*."""
+        stats = [
+            {"task": task, "calls": calls, "time": seconds}
+            for task, (calls, seconds) in self._get_sorted_stats()
+        ]
+        Path(path).write_text(json.dumps(stats, indent=2) + "\n")
+
+
+def _measure(profile, task):
+    return profile.measure(task) if profile else contextlib.nullcontext()
+
+
 class _Function:
-    def __init__(self, function, filename):
+    def __init__(self, function, filename, pass_run_dir):
         self.function = function
         self.filename = filename
+        self.pass_run_dir = pass_run_dir
+
+    def __str__(self):
+        name = getattr(self.function, "__qualname__", repr(self.function))
+        module = getattr(self.function, "__module__", None)
+        return f"{module}.{name}" if module else name
+
+    def __call__(self, content, props, run_dir):
+        if self.pass_run_dir:
+            self.function(content, props, run_dir)
+            return
+        # Compatibility mode: run the function in the run directory.
+        with _CHDIR_LOCK:
+            old_cwd = Path.cwd()
+            os.chdir(run_dir)
+            try:
+                self.function(content, props)
+            finally:
+                os.chdir(old_cwd)
+
+
+def _search_last(regex, content):
+    """Return the last match of *regex* in *content* or None.
+
+    Search increasingly large blocks at the end of *content*. Each block
+    starts at the beginning of a line, so patterns that don't span lines
+    yield the same result as taking the last match of ``regex.finditer()``
+    on the whole content. For memory-mapped files, only the pages at the
+    end of the file are read if the pattern occurs there.
+
+    >>> _search_last(re.compile(r"cost: (\\d+)"), "cost: 1\\ncost: 2\\nend\\n")[1]
+    '2'
+    """
+    newline = "\n" if isinstance(content, str) else b"\n"
+    block_size = LAST_MATCH_BLOCK_SIZE
+    while True:
+        start = max(0, len(content) - block_size)
+        if start > 0:
+            start = content.rfind(newline, 0, start) + 1
+        match = next(iter(deque(regex.finditer(content, start), maxlen=1)), None)
+        if match is not None or start == 0:
+            return match
+        block_size *= 4
 
 
 class _Pattern:
-    def __init__(self, attribute, regex, required, type_, flags):
+    def __init__(self, attribute, regex, required, type_, flags, match="first"):
+        if match not in MATCH_MODES:
+            raise ValueError(f"match must be one of {MATCH_MODES}, not {match!r}")
         self.attribute = attribute
         self.type_ = type_
         self.required = required
+        self.match = match
         self.group = 1
 
+        self.fingerprint = repr((attribute, regex, required, repr(type_), flags, match))
         flags = _get_pattern_flags(flags)
         self.regex = re.compile(regex, flags)
+        self._bytes_regex = None
+
+    @property
+    def bytes_regex(self):
+        """The regex compiled for searching UTF-8 encoded bytes."""
+        if self._bytes_regex is None:
+            self._bytes_regex = re.compile(
+                self.regex.pattern.encode(tools.DEFAULT_ENCODING),
+                self.regex.flags & ~re.UNICODE,
+            )
+        return self._bytes_regex
+
+    def _get_value(self, match):
+        value = match.group(self.group)
+        if isinstance(value, bytes):
+            value = tools.get_string(value)
+        return self.type_(value)
+
+    def _add_missing_group_error(self, filename, props):
+        tools.add_unexplained_error(
+            props,
+            f"Attribute {self.attribute} not found for pattern {self} in "
+            f"file {filename}.",
+        )
+
+    def _search_all(self, regex, filename, content, props):
+        try:
+            values = [self._get_value(match) for match in regex.finditer(content)]
+        except IndexError:
+            self._add_missing_group_error(filename, props)
+            return {}
+        if not values and self.required:
+            tools.add_unexplained_error(
+                props, f'Pattern "{self}" not found in {filename}'
+            )
+        return {self.attribute: values}
 
     def search(self, filename, content, props):
+        """Search *content*, which may be a str or a bytes-like object."""
         found_props = {}
-        match = self.regex.search(content)
+        regex = self.regex if isinstance(content, str) else self.bytes_regex
+        if self.match == "all":
+            return self._search_all(regex, filename, content, props)
+        if self.match == "last":
+            match = _search_last(regex, content)
+        else:
+            match = regex.search(content)
         if match:
             try:
-                value = match.group(self.group)
+                value = self._get_value(match)
             except IndexError:
-                tools.add_unexplained_error(
-                    props,
-                    f"Attribute {self.attribute} not found for pattern {self} in "
-                    f"file {filename}.",
-                )
+                self._add_missing_group_error(filename, props)
             else:
-                value = self.type_(value)
                 found_props[self.attribute] = value
         elif self.required:
             tools.add_unexplained_error(
@@ -79,6 +327,97 @@ class _Pattern:
         return self.regex.pattern
 
 
+class _RunFiles:
+    """
+    Private class that reads each file of a run directory at most once.
+
+    If a file is missing, but a compressed variant exists (e.g.,
+    "run.log.xz" for "run.log"), the compressed file is decompressed on
+    the fly.
+    """
+
+    def __init__(self, run_dir, profile=None):
+        self.run_dir = Path(run_dir).resolve()
+        self.profile = profile
+        self._contents = {}
+        self._mmaps = {}
+
+    def _measure_read(self, path):
+        if self.profile is None:
+            return contextlib.nullcontext()
+        # Use relative paths to accumulate the stats of all runs.
+        if path.is_relative_to(self.run_dir):
+            path = path.relative_to(self.run_dir)
+        return _measure(self.profile, f"read {path}")
+
+    def get_content(self, path):
+        """Return the contents of *path* or None if it doesn't exist."""
+        if path not in self._contents:
+            with self._measure_read(path):
+                self._contents[path] = self._read(path)
+        return self._contents[path]
+
+    @staticmethod
+    def _read(path):
+        try:
+            return path.read_text()
+        except FileNotFoundError:
+            compressed_path = tools.find_compressed(path)
+            if compressed_path is None:
+                return None
+            with tools.open_compressed(compressed_path) as f:
+                return io.TextIOWrapper(f, encoding=tools.DEFAULT_ENCODING).read()
+
+    def get_mmap(self, path):
+        """Return the bytes of *path* or None if it doesn't exist.
+
+        Map the file into memory instead of reading it, if possible.
+        """
+        if path in self._contents:
+            content = self._contents[path]
+            return None if content is None else content.encode(tools.DEFAULT_ENCODING)
+        if path not in self._mmaps:
+            with self._measure_read(path):
+                self._mmaps[path] = self._map(path)
+        return self._mmaps[path]
+
+    @staticmethod
+    def _map_file(f):
+        try:
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (ValueError, OSError):
+            # Empty files and some file systems don't support mmap.
+            f.seek(0)
+            return f.read()
+
+    @classmethod
+    def _map(cls, path):
+        try:
+            with open(path, "rb") as f:
+                return cls._map_file(f)
+        except FileNotFoundError:
+            compressed_path = tools.find_compressed(path)
+            if compressed_path is None:
+                return None
+            # Decompress block by block into an anonymous temporary file and
+            # map that, so that the decompressed data never has to fit into
+            # memory.
+            with (
+                tools.open_compressed(compressed_path) as src,
+                tempfile.TemporaryFile() as dest,
+            ):
+                shutil.copyfileobj(src, dest, DECOMPRESSION_BLOCK_SIZE)
+                dest.flush()
+                return cls._map_file(dest)
+
+    def close(self):
+        for content in self._mmaps.values():
+            if isinstance(content, mmap.mmap):
+                with contextlib.suppress(BufferError):
+                    content.close()
+        self._mmaps.clear()
+
+
 class _FileParser:
     """
     Private class that searches a given file for the added patterns.
@@ -90,23 +429,52 @@ class _FileParser:
     def add_pattern(self, pattern):
         self.patterns.append(pattern)
 
-    def search_patterns(self, filename, content, props):
+    def search_patterns(self, filename, content, props, profile=None, file=None):
         for pattern in self.patterns:
-            props.update(pattern.search(filename, content, props))
+            with _measure(profile, f"pattern {file or filename}: {pattern}"):
+                props.update(pattern.search(filename, content, props))
 
 
 class Parser:
     """
     Parse logs or files in a given directory and write results into the
     ``properties`` file.
+
+    If a file doesn't exist, the parser reads its compressed variant
+    instead, if there is one. For example, patterns and functions for
+    "run.log" are applied to the decompressed content of "run.log.xz",
+    "run.log.gz" or "run.log.zst". Reading zstd files requires Python
+    3.14 or the ``zstandard`` package.
     """
 
-    def __init__(self):
+    def __init__(self, use_mmap=False):
+        """
+        By default, the parser reads each file into a string. If
+        *use_mmap* is True, the patterns are searched in the memory-mapped
+        bytes of the file instead and only the matched groups are decoded
+        as UTF-8. This needs much less memory for huge logs. Files for
+        which functions are registered with :meth:`.add_function` are
+        still read into a string. In this mode, the regular expressions
+        are bytes patterns, so classes like ``\\d`` and ``\\w`` only
+        match ASCII characters.
+
+        >>> parser = Parser(use_mmap=True)
+        >>> parser.add_pattern("cost", r"Plan cost: (.+)\\n", type=float)
+
+        """
         self.file_parsers = defaultdict(_FileParser)
         self.functions = []
+        self.use_mmap = use_mmap
 
     def add_pattern(
-        self, attribute, regex, file="run.log", type=int, flags="", required=False
+        self,
+        attribute,
+        regex,
+        file="run.log",
+        type=int,
+        flags="",
+        required=False,
+        match="first",
     ):
         r"""
         Look for *regex* in *file*, cast what is found in brackets to
@@ -126,8 +494,18 @@ class Parser:
         If *required* is True and the pattern is not found in *file*,
         an error message is printed to stderr.
 
+        *match* selects which matches are stored: "first" (default)
+        stores the first match and "last" stores the last match. "last"
+        searches blocks at the end of the file, which is much faster than
+        a full scan for values that are printed at the end of big logs,
+        especially with ``Parser(use_mmap=True)``. It is meant for
+        patterns that don't span multiple lines. "all" stores the list of
+        all matches (which is empty if there is no match).
+
         >>> parser = Parser()
         >>> parser.add_pattern("facts", r"Facts: (\d+)", type=int)
+        >>> parser.add_pattern("time", r"Time: (.+)s", type=float, match="last")
+        >>> parser.add_pattern("costs", r"Plan cost: (.+)\n", type=float, match="all")
 
         """
         if type is bool:
@@ -136,10 +514,10 @@ class Parser:
                 "evaluate to true. Are you sure you want to use type=bool?"
             )
         self.file_parsers[file].add_pattern(
-            _Pattern(attribute, regex, required, type, flags)
+            _Pattern(attribute, regex, required, type, flags, match)
         )
 
-    def add_function(self, function, file="run.log"):
+    def add_function(self, function, file="run.log", pass_run_dir=False):
         r"""Call ``function(open(file).read(), properties)`` during parsing.
 
         Functions are applied **after** all patterns have been
@@ -164,8 +542,39 @@ class Parser:
         parsing function detects that something went wrong during the
         run.
 
+        By default, the function is called in the run directory, i.e.,
+        it may open other files of the run with relative paths. Since
+        the working directory is global to the process, these calls are
+        serialized. If *pass_run_dir* is True, the working directory is
+        left unchanged and the function is called as ``function(content,
+        properties, run_dir)`` instead, where *run_dir* is the absolute
+        :class:`pathlib.Path` of the run directory. Such functions can
+        run concurrently when runs are parsed in threads (see
+        :meth:`Experiment.parse() <lab.experiment.Experiment.parse>`).
+
+        >>> def parse_plan_length(content, props, run_dir):
+        ...     plan = run_dir / "sas_plan"
+        ...     if plan.is_file():
+        ...         props["plan_length"] = len(plan.read_text().splitlines()) - 1
+        ...
+        >>> parser.add_function(parse_plan_length, pass_run_dir=True)
+
         """
-        self.functions.append(_Function(function, file))
+        self.functions.append(_Function(function, file, pass_run_dir))
+
+    def _get_fingerprint(self):
+        """Return a hash of the patterns and functions of this parser."""
+        parts = [
+            f"{filename}: {pattern.fingerprint}"
+            for filename, file_parser in self.file_parsers.items()
+            for pattern in file_parser.patterns
+        ]
+        parts.extend(
+            f"{function.filename}: {function.pass_run_dir}: "
+            f"{_get_callable_fingerprint(function.function)}"
+            for function in self.functions
+        )
+        return hashlib.sha1("\n".join(parts).encode()).hexdigest()
 
     def parse(self, run_dir, props):
         """Search all patterns and apply all functions.
@@ -173,37 +582,50 @@ class Parser:
         Add the found values to *props*.
 
         """
-        run_dir = Path(run_dir).resolve()
-
-        content_cache = {}
-
-        def get_content(path):
-            if path not in content_cache:
-                try:
-                    content_cache[path] = path.read_text()
-                except FileNotFoundError:
-                    content_cache[path] = None
-            return content_cache[path]
+        run_files = _RunFiles(run_dir)
+        try:
+            self._parse(run_files, props)
+        finally:
+            run_files.close()
 
+    def _parse(self, run_files, props):
+        run_dir = run_files.run_dir
         for filename, file_parser in self.file_parsers.items():
             # If filename is absolute, path is set to filename.
             path = run_dir / filename
-            content = get_content(path)
+            if self.use_mmap:
+                content = run_files.get_mmap(path)
+            else:
+                content = run_files.get_content(path)
             if content is None:
                 if any(pattern.required for pattern in file_parser.patterns):
                     tools.add_unexplained_error(
                         props, f'Required file "{path}" is missing.'
                     )
             else:
-                file_parser.search_patterns(str(path), content, props)
+                file_parser.search_patterns(
+                    str(path), content, props, run_files.profile, filename
+                )
 
         for function in self.functions:
             path = run_dir / function.filename
             # Call function with empty string if file is missing.
-            content = get_content(path) or ""
+            content = run_files.get_content(path) or ""
+            with _measure(run_files.profile, f"function {function}"):
+                function(content, props, run_dir)
 
-            # Run function in the run directory.
-            old_cwd = Path.cwd()
-            os.chdir(run_dir)
-            function.function(content, props)
-            os.chdir(old_cwd)
+
+def parse_run(parsers, run_dir, props, profile=None):
+    """Apply all *parsers* to *run_dir* and add the found values to *props*.
+
+    Each file is read only once, even if multiple parsers use it. If
+    *profile* is a :class:`ParseProfile`, add the time spent on each task
+    to it.
+
+    """
+    run_files = _RunFiles(run_dir, profile)
+    try:
+        for parser in parsers:
+            parser._parse(run_files, props)
+    finally:
+        run_files.close()
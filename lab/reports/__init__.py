@@ -149,7 +149,9 @@ class Report:
     Base class for all reports.
     """
 
-    def __init__(self, attributes=None, format="html", filter=None, **kwargs):
+    def __init__(
+        self, attributes=None, format="html", filter=None, run_records=False, **kwargs
+    ):
         """
         Inherit from this or a child class to implement a custom report.
 
@@ -188,6 +190,14 @@ class Report:
         Filters given as ``filter_*`` kwargs are applied *after* all
         filters passed via the ``filter`` kwarg.
 
+        If *run_records* is True, the runs of a properties file are
+        loaded as read-only :class:`~lab.tools.RunRecord` objects, which
+        need much less memory than dicts for big experiments. Records
+        with the same attributes share their lookup tables and can't be
+        changed, so filters must not modify runs in place. Instead, they
+        must return a modified copy of the run, e.g.,
+        ``{**run, "algorithm": "LAMA 2011"}``.
+
         Examples:
 
         Include only the "cost" attribute in a LaTeX report:
@@ -249,6 +259,7 @@ class Report:
         self.output_format = format
         self.toc = True
         self.run_filter = tools.RunFilter(filter, **kwargs)
+        self.run_records = run_records
 
     def __call__(self, eval_dir, outfile):
         """Make the report.
@@ -417,12 +428,38 @@ class Report:
 
     def _load_data(self):
         props_file = os.path.join(self.eval_dir, "properties")
+        database_file = os.path.join(self.eval_dir, tools.PROPERTIES_DATABASE_FILENAME)
+        if os.path.exists(database_file) and not tools.Properties.exists(props_file):
+            self._load_database(database_file)
+            return
         logging.info("Reading properties file")
-        self.props = tools.Properties(filename=props_file)
+        # Let runs share repeated strings. Reports access all runs, so
+        # decoding them lazily only pays off if filter_* arguments drop
+        # runs right after decoding them, which lowers the peak memory.
+        if self.run_filter.get_key_filters(self.run_filter.filtered_attributes):
+            properties_class = tools.LazyProperties
+        else:
+            properties_class = tools.Properties
+        self.props = properties_class(
+            props_file, intern_strings=True, run_records=self.run_records
+        )
         if not self.props:
             logging.critical(f"No properties found in {self.eval_dir}")
         logging.info("Reading properties file finished")
 
+    def _load_database(self, database_file):
+        # Only load the runs that match the filter_* arguments for the
+        # indexed attributes.
+        database = tools.PropertiesDatabase(database_file)
+        key_filters = self.run_filter.get_key_filters(database.KEY_ATTRIBUTES)
+        logging.info(f"Reading properties database (selecting {key_filters})")
+        self.props = database.load(**key_filters)
+        if not self.props:
+            if key_filters:
+                logging.critical("All runs have been filtered -> Nothing to report.")
+            logging.critical(f"No properties found in {self.eval_dir}")
+        logging.info("Reading properties database finished")
+
     def _apply_filter(self):
         self.run_filter.apply(self.props)
         if not self.props:
@@ -1,14 +1,21 @@
 import argparse
+import collections.abc
 import colorsys
+import concurrent.futures
 import contextlib
+import fcntl
 import functools
+import gzip
+import io
 import logging
 import lzma
 import math
+import multiprocessing
 import os
 import pkgutil
 import re
 import shutil
+import sqlite3
 import subprocess
 import sys
 from pathlib import Path
@@ -26,9 +33,120 @@ try:
 except ImportError:
     import json
 
+# orjson is optional. If it is installed, compact properties files are read and
+# written with it, which is several times faster than the json modules.
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Python 3.14 ships zstd support. For older versions, use the zstandard package
+# if it is installed. Both modules provide a compatible open() function.
+try:
+    from compression import zstd
+except ImportError:
+    try:
+        import zstandard as zstd
+    except ImportError:
+        zstd = None
+
 
 DEFAULT_ENCODING = "utf-8"
 
+# Suffixes of compressed files that lab reads transparently.
+COMPRESSION_SUFFIXES = (".xz", ".gz", ".zst")
+
+
+def open_compressed(path, mode="rb"):
+    """Open *path* with the decompressor that matches its suffix.
+
+    Files without a known compression suffix are opened uncompressed.
+    """
+    suffix = Path(path).suffix
+    if suffix == ".xz":
+        return lzma.open(path, mode)
+    elif suffix == ".gz":
+        return gzip.open(path, mode)
+    elif suffix == ".zst":
+        if zstd is None:
+            logging.critical(
+                f"Opening {path} requires Python 3.14 or the zstandard package."
+            )
+        return zstd.open(path, mode)
+    else:
+        return open(path, mode)
+
+
+@contextlib.contextmanager
+def open_compressed_for_writing(path, level=None, threads=1):
+    """Open *path* for writing binary data, compressed according to its suffix.
+
+    *level* is the compression level (xz: 0-9, gzip: 1-9, zstd: 1-22).
+    None selects the default level of the compressor. With *threads* > 1,
+    xz and zstd compress in parallel. Python's lzma module can only use
+    a single thread, so parallel xz compression pipes the data through
+    the ``xz`` program if it is installed.
+    """
+    path = Path(path)
+    suffix = path.suffix
+    if suffix == ".xz" and threads > 1 and shutil.which("xz"):
+        cmd = ["xz", "--stdout", f"--threads={threads}"]
+        if level is not None:
+            cmd.append(f"-{level}")
+        with open(path, "wb") as outfile:
+            proc = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=outfile)
+            try:
+                yield proc.stdin
+            finally:
+                proc.stdin.close()
+                retcode = proc.wait()
+        if retcode != 0:
+            logging.critical(f"Compressing {path} with xz failed ({retcode}).")
+    elif suffix == ".xz":
+        with lzma.open(path, "wb", preset=level) as f:
+            yield f
+    elif suffix == ".gz":
+        with gzip.open(path, "wb", compresslevel=9 if level is None else level) as f:
+            yield f
+    elif suffix == ".zst":
+        if zstd is None:
+            logging.critical(
+                f"Writing {path} requires Python 3.14 or the zstandard package."
+            )
+        if zstd.__name__ == "compression.zstd" and threads > 1:
+            options = {zstd.CompressionParameter.nb_workers: threads}
+            if level is not None:
+                # ZstdFile doesn't accept both level and options.
+                options[zstd.CompressionParameter.compression_level] = level
+            f = zstd.open(path, "wb", options=options)
+        elif zstd.__name__ == "compression.zstd":
+            f = zstd.open(path, "wb", level=level)
+        else:
+            cctx = zstd.ZstdCompressor(
+                level=3 if level is None else level,
+                threads=threads if threads > 1 else 0,
+            )
+            f = zstd.open(path, "wb", cctx=cctx)
+        with f:
+            yield f
+    else:
+        with open(path, "wb") as f:
+            yield f
+
+
+def find_compressed(path):
+    """Return the first existing compressed variant of *path* or None.
+
+    For example, for "run.log" look for "run.log.xz", "run.log.gz" and
+    "run.log.zst".
+    """
+    path = Path(path)
+    for suffix in COMPRESSION_SUFFIXES:
+        compressed_path = path.with_name(path.name + suffix)
+        if compressed_path.is_file():
+            return compressed_path
+    return None
+
 
 def get_string(s):
     if isinstance(s, bytes):
@@ -179,6 +297,27 @@ def write_file(filename, content):
     path.write_text(content)
 
 
+def append_json_line(path, obj):
+    """Append *obj* as one line of compact JSON to the file *path*.
+
+    The line is written while holding an exclusive lock on the file, so
+    lines of concurrent writers (also on different hosts sharing a
+    network file system) never interleave.
+    """
+    line = json.dumps(
+        obj, cls=Properties._PropertiesEncoder, separators=(",", ":"), allow_nan=True
+    )
+    data = f"{line}\n".encode(DEFAULT_ENCODING)
+    fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o666)
+    try:
+        fcntl.lockf(fd, fcntl.LOCK_EX)
+        while data:
+            data = data[os.write(fd, data) :]
+    finally:
+        # Closing the file also releases the lock.
+        os.close(fd)
+
+
 def fill_template(template_name, **parameters):
     template = get_string(
         pkgutil.get_data("lab", os.path.join("data", template_name + ".template"))
@@ -227,6 +366,75 @@ def find_file(filenames, dir="."):
     raise OSError(f"none found in {dir!r}: {filenames!r}")
 
 
+class _WorkerExit(Exception):
+    """Signal that a worker process aborted with sys.exit()."""
+
+    def __init__(self, code):
+        super().__init__(code)
+        self.code = code
+
+
+# Function applied by the worker processes of map_parallel(). Forked
+# workers inherit it, so it doesn't have to be picklable.
+_parallel_func = None
+
+
+def _call_parallel_func(item):
+    try:
+        return _parallel_func(item)
+    except SystemExit as err:
+        # Pool workers don't survive SystemExit, so pass it to the parent.
+        raise _WorkerExit(err.code) from None
+
+
+def _map_threaded(func, items, threads):
+    with concurrent.futures.ThreadPoolExecutor(threads) as executor:
+        futures = [executor.submit(func, item) for item in items]
+        try:
+            for future in futures:
+                yield future.result()
+        finally:
+            for future in futures:
+                future.cancel()
+
+
+def map_parallel(func, items, processes=1, chunksize=1, threads=1):
+    """Yield *func(item)* for all *items* in order.
+
+    If *processes* > 1, distribute the items in chunks of *chunksize* to
+    a pool of forked worker processes. The items and the results must be
+    picklable, but *func* doesn't have to be. If *func* aborts in a worker
+    (e.g., via ``logging.critical()``), the main process aborts as well.
+
+    If *threads* > 1, call *func* in a pool of this many threads instead.
+    This is cheaper than processes if *func* mostly waits for I/O, but
+    *func* must be thread-safe. Only one of *processes* and *threads* may
+    be greater than 1.
+
+    """
+    global _parallel_func
+    if processes < 1 or threads < 1:
+        raise ValueError("processes and threads must be at least 1")
+    if processes > 1 and threads > 1:
+        raise ValueError("only one of processes and threads may be greater than 1")
+    if threads > 1:
+        yield from _map_threaded(func, items, threads)
+        return
+    if processes == 1:
+        yield from map(func, items)
+        return
+    if _parallel_func is not None:
+        raise ValueError("map_parallel() calls can't be nested")
+    _parallel_func = func
+    try:
+        with multiprocessing.get_context("fork").Pool(processes) as pool:
+            yield from pool.imap(_call_parallel_func, items, chunksize)
+    except _WorkerExit as err:
+        sys.exit(err.code)
+    finally:
+        _parallel_func = None
+
+
 def run_command(cmd, **kwargs):
     """Run command cmd and return the output."""
     logging.info(f"Executing {' '.join(cmd)} {kwargs}")
@@ -263,11 +471,91 @@ def compute_log_score(success, value, lower_bound, upper_bound):
     return raw_score / best_raw_score
 
 
+def _intern_strings(value):
+    """Return *value* with interned strings and dictionary keys.
+
+    Runs repeat the same attribute names, algorithms, domains and ID
+    parts many times, so interning lets them share one string object.
+    """
+    if isinstance(value, str):
+        return sys.intern(value)
+    elif isinstance(value, dict):
+        return {
+            sys.intern(key) if isinstance(key, str) else key: _intern_strings(item)
+            for key, item in value.items()
+        }
+    elif isinstance(value, list):
+        return [_intern_strings(item) for item in value]
+    else:
+        return value
+
+
+class RunRecord(collections.abc.Mapping):
+    """Read-only mapping that stores a run more compactly than a dict.
+
+    Records of runs with the same attributes that are created with the
+    same *layouts* dict share a lookup table from attribute names to
+    positions, and each record only stores a tuple of values. *layouts*
+    maps tuples of attribute names to these tables and is filled on
+    demand. Pass ``run_records=True`` to :class:`Properties` or
+    :class:`LazyProperties` to load runs as records. Since records can't
+    be changed, filters must return a modified copy (e.g., a dict)
+    instead of changing runs in place.
+
+    >>> record = RunRecord({"algorithm": "lama", "cost": 42})
+    >>> record["cost"], record.get("coverage"), dict(record)
+    (42, None, {'algorithm': 'lama', 'cost': 42})
+
+    """
+
+    __slots__ = ("_index", "_values")
+
+    def __init__(self, run, layouts=None):
+        keys = tuple(run)
+        index = None if layouts is None else layouts.get(keys)
+        if index is None:
+            index = {key: position for position, key in enumerate(keys)}
+            if layouts is not None:
+                layouts[keys] = index
+        self._index = index
+        self._values = tuple(run.values())
+
+    def __getitem__(self, attribute):
+        return self._values[self._index[attribute]]
+
+    def __contains__(self, attribute):
+        return attribute in self._index
+
+    def __iter__(self):
+        return iter(self._index)
+
+    def __len__(self):
+        return len(self._values)
+
+    def __repr__(self):
+        return f"RunRecord({dict(self)!r})"
+
+
+def _load_run(run, intern_strings, record_layouts):
+    """Return the decoded *run* with interned strings and/or as a record.
+
+    *record_layouts* is None or the layouts dict shared by all records
+    of one properties file (see :class:`RunRecord`).
+    """
+    if intern_strings:
+        run = _intern_strings(run)
+    if record_layouts is not None and isinstance(run, dict):
+        return RunRecord(run, record_layouts)
+    return run
+
+
 class Properties(dict):
     class _PropertiesEncoder(json.JSONEncoder):
         def default(self, o):
             if isinstance(o, Path):
                 return str(o)
+            elif isinstance(o, RunRecord):
+                return dict(o)
             else:
                 return super().default(o)
 
@@ -279,31 +567,87 @@ class Properties(dict):
         "allow_nan": True,
     }
 
-    """Transparently handle properties files compressed with xz."""
+    # Compact JSON is much faster to write and read, but hard to read for
+    # humans. Use pretty_print_properties() to inspect such files.
+    COMPACT_JSON_ARGS = {
+        "cls": _PropertiesEncoder,
+        "separators": (",", ":"),
+        "sort_keys": False,
+        "allow_nan": True,
+    }
+
+    """Transparently handle properties files compressed with xz, gzip or zstd.
+
+    The compression is chosen by the suffix of the path, e.g.,
+    "properties.zst". If only a compressed variant of *filename* exists,
+    it is loaded and written instead.
+
+    If *compact* is True, :meth:`write` omits indentation and doesn't
+    sort keys. *compression_level* and *compression_threads* are passed
+    to :func:`open_compressed_for_writing`.
+
+    If *intern_strings* is True, loading interns all strings and keys,
+    so that runs share repeated strings such as attribute names,
+    algorithms and domains. This saves memory but makes loading slower.
+    If *run_records* is True, the loaded runs are read-only
+    :class:`RunRecord` objects, which need much less memory than dicts.
+    """
 
-    def __init__(self, filename=None):
+    def __init__(
+        self,
+        filename=None,
+        compact=False,
+        compression_level=None,
+        compression_threads=1,
+        intern_strings=False,
+        run_records=False,
+    ):
+        self.compact = compact
+        self.intern_strings = intern_strings
+        self.run_records = run_records
+        self.compression_level = compression_level
+        self.compression_threads = compression_threads
         self.path = Path(filename).resolve() if filename else None
         if self.path:
-            xz_path = self.path.with_suffix(".xz")
-            if self.path != xz_path and self.path.is_file() and xz_path.is_file():
-                logging.critical(f"Only one of {self.path} and {xz_path} may exist")
-            if not self.path.is_file() and xz_path.is_file():
-                self.path = xz_path
+            self.path = Properties._find_file(self.path)
             if self.path.is_file():
                 self.load(self.path)
         dict.__init__(self)
 
+    @staticmethod
+    def _get_existing_variants(path):
+        variants = [path] + [path.with_suffix(s) for s in COMPRESSION_SUFFIXES]
+        return [p for p in dict.fromkeys(variants) if p.is_file()]
+
+    @staticmethod
+    def _find_file(path):
+        """Return the existing (compressed) variant of *path* or *path*."""
+        existing = Properties._get_existing_variants(path)
+        if len(existing) > 1:
+            logging.critical(f"Only one of {', '.join(map(str, existing))} may exist")
+        return existing[0] if existing else path
+
+    @staticmethod
+    def exists(filename):
+        """Return True if *filename* or a compressed variant of it exists."""
+        return bool(Properties._get_existing_variants(Path(filename)))
+
     def __str__(self):
         return json.dumps(self, **self.JSON_ARGS)
 
     def load(self, filename):
         path = Path(filename)
-        open_func = lzma.open if path.suffix == ".xz" else open
-        with open_func(path) as f:
+        with open_compressed(path) as f:
             try:
-                self.update(json.load(f, allow_nan=True))
+                content = _load_json(f.read())
             except ValueError as e:
                 logging.critical(f"JSON parse error in file '{path}': {e}")
+        if not self.intern_strings and not self.run_records:
+            self.update(content)
+            return
+        record_layouts = {} if self.run_records else None
+        for key, value in content.items():
+            self[key] = _load_run(value, self.intern_strings, record_layouts)
 
     def add_unexplained_error(self, error):
         add_unexplained_error(self, error)
@@ -312,15 +656,433 @@ class Properties(dict):
         """Write the properties to disk."""
         assert self.path
         self.path.parent.mkdir(parents=True, exist_ok=True)
-        open_func = lzma.open if self.path.suffix == ".xz" else open
-        with open_func(self.path, "w") as f:
-            json.dump(self, f, **self.JSON_ARGS)
+        with (
+            open_compressed_for_writing(
+                self.path, self.compression_level, self.compression_threads
+            ) as raw,
+            io.TextIOWrapper(raw, encoding=DEFAULT_ENCODING) as f,
+        ):
+            if self.compact:
+                f.write(_dump_compact_json(self))
+            else:
+                json.dump(self, f, **self.JSON_ARGS)
+
+
+def _load_json(content):
+    if orjson is not None:
+        try:
+            return orjson.loads(content)
+        except orjson.JSONDecodeError:
+            # orjson rejects NaN and Infinity, so parse the content again.
+            pass
+    return json.loads(content, allow_nan=True)
+
+
+def _has_non_finite_floats(obj):
+    stack = [obj]
+    while stack:
+        obj = stack.pop()
+        if isinstance(obj, float):
+            if not math.isfinite(obj):
+                return True
+        elif isinstance(obj, dict | RunRecord):
+            stack.extend(obj.values())
+        elif isinstance(obj, list | tuple):
+            stack.extend(obj)
+    return False
+
+
+def _orjson_default(obj):
+    if isinstance(obj, Path):
+        return str(obj)
+    elif isinstance(obj, RunRecord):
+        return dict(obj)
+    raise TypeError
+
+
+def _dump_compact_json(props):
+    # orjson would write NaN and Infinity as null, so only use it without them.
+    if orjson is not None and not _has_non_finite_floats(props):
+        try:
+            return orjson.dumps(props, default=_orjson_default).decode()
+        except TypeError:
+            # E.g., non-string keys or integers with more than 64 bits.
+            pass
+    return json.dumps(props, **Properties.COMPACT_JSON_ARGS)
+
+
+# JSON strings can't contain raw line breaks, so in files written with an
+# indentation of two spaces, only the top-level keys start a line with
+# exactly two spaces and a quote.
+_INDENTED_RUN_KEY_REGEX = re.compile(rb'\n  "')
+_JSON_STRING_REGEX = re.compile(rb'"(?:[^"\\]|\\.)*"', re.S)
+
+
+def _index_indented_runs(content, start):
+    key_positions = [
+        match.start() for match in _INDENTED_RUN_KEY_REGEX.finditer(content, start)
+    ]
+    object_end = content.rindex(b"}")
+    runs = {}
+    for index, pos in enumerate(key_positions):
+        key_match = _JSON_STRING_REGEX.match(content, pos + 3)
+        value_start = content.index(b":", key_match.end()) + 1
+        if index + 1 < len(key_positions):
+            value_end = content.rindex(b",", value_start, key_positions[index + 1])
+        else:
+            value_end = object_end
+        runs[_load_json(key_match.group())] = slice(value_start, value_end)
+    return runs
+
+
+def _index_runs(content):
+    """Map the top-level keys of JSON object *content* to their value slices.
+
+    Return None if *content* is not indented with two spaces, e.g., for
+    compact files. Finding the runs in these files requires tokenizing
+    the whole content, which is slower than decoding it.
+    """
+    start = len(content) - len(content.lstrip())
+    if content.startswith(b'{\n  "', start):
+        return _index_indented_runs(content, start)
+    return None
+
+
+class LazyProperties(collections.abc.MutableMapping):
+    """Load a properties file and decode each run only when it's accessed.
+
+    Loading only records where each run is stored in the file, which
+    takes much less time and memory than decoding all runs. This only
+    pays off if most runs are never accessed or are removed right after
+    decoding them, e.g., by ``filter_*`` arguments of reports. Decoding
+    all runs one by one is slower than :class:`Properties`. Compact
+    files (see *compact* in :class:`Properties`) are decoded completely
+    when loading them, since indexing them would take longer. Decoded
+    runs are kept, so changes to them persist. The file content is
+    released once all remaining runs are decoded. Otherwise, the object
+    behaves like :class:`Properties`, but it can't be written to disk.
+    See :class:`Properties` for *intern_strings* and *run_records*.
+
+    >>> props = Properties("/tmp/lazy-properties-example")
+    >>> props["run1"] = {"id": ["run1"], "cost": 3}
+    >>> props.write()
+    >>> lazy = LazyProperties("/tmp/lazy-properties-example")
+    >>> list(lazy), lazy["run1"]["cost"]
+    (['run1'], 3)
+
+    """
+
+    def __init__(self, filename, intern_strings=False, run_records=False):
+        self.intern_strings = intern_strings
+        self._record_layouts = {} if run_records else None
+        self.path = Properties._find_file(Path(filename).resolve())
+        self._content = b""
+        self._runs = {}
+        if self.path.is_file():
+            with open_compressed(self.path) as f:
+                self._content = f.read()
+            try:
+                self._runs = _index_runs(self._content)
+                if self._runs is None:
+                    self._runs = self._load_all_runs()
+            except ValueError as e:
+                logging.critical(f"JSON parse error in file '{self.path}': {e}")
+        self._num_undecoded = len(self._runs) if self._content else 0
+        self._release_content_if_decoded()
+
+    def _load_all_runs(self):
+        runs = _load_json(self._content)
+        if not isinstance(runs, dict):
+            raise ValueError("expected a JSON object")
+        self._content = b""
+        return {run_id: self._load_run(run) for run_id, run in runs.items()}
+
+    def _load_run(self, run):
+        return _load_run(run, self.intern_strings, self._record_layouts)
+
+    def _release_content_if_decoded(self):
+        if not self._num_undecoded:
+            self._content = b""
+
+    def _forget_undecoded(self, run_id):
+        if isinstance(self._runs.get(run_id), slice):
+            self._num_undecoded -= 1
+
+    def __getitem__(self, run_id):
+        run = self._runs[run_id]
+        if isinstance(run, slice):
+            try:
+                run = _load_json(self._content[run])
+            except ValueError as e:
+                logging.critical(f"JSON parse error in file '{self.path}': {e}")
+            run = self._load_run(run)
+            self._forget_undecoded(run_id)
+            self._runs[run_id] = run
+            self._release_content_if_decoded()
+        return run
+
+    def __setitem__(self, run_id, run):
+        self._forget_undecoded(run_id)
+        self._runs[run_id] = run
+        self._release_content_if_decoded()
+
+    def __delitem__(self, run_id):
+        self._forget_undecoded(run_id)
+        del self._runs[run_id]
+        self._release_content_if_decoded()
+
+    def __contains__(self, run_id):
+        return run_id in self._runs
+
+    def __iter__(self):
+        return iter(self._runs)
+
+    def __len__(self):
+        return len(self._runs)
+
+    def __str__(self):
+        return json.dumps(dict(self.items()), **Properties.JSON_ARGS)
+
+
+def pretty_print_properties(filename, outfile=None):
+    """Write properties file *filename* with indentation and sorted keys.
+
+    This makes compact properties files readable for humans. The result
+    is written to *outfile* or, if it is None, printed. ::
+
+        exp.add_step(
+            "pretty-print", tools.pretty_print_properties,
+            Path(exp.eval_dir) / "properties", Path(exp.eval_dir) / "properties.txt"
+        )
+
+    """
+    props = Properties(filename=filename)
+    if not props:
+        logging.critical(f"No properties found in {filename}")
+    if outfile is None:
+        print(props)
+    else:
+        write_file(outfile, f"{props}\n")
+
+
+PROPERTIES_DATABASE_FILENAME = "properties.sqlite"
+
+
+def _is_sql_value(value):
+    return isinstance(value, str | int | float)
+
+
+class PropertiesDatabase:
+    """Store combined properties in an indexed SQLite database.
+
+    Each run is one row. The run ID and the key attributes "domain",
+    "problem" and "algorithm" are indexed columns and all properties of
+    the run are stored as JSON text. Selecting runs by key attributes
+    only decodes the matching runs.
+    """
+
+    KEY_ATTRIBUTES = ("domain", "problem", "algorithm")
+
+    def __init__(self, path):
+        self.path = Path(path)
+
+    def write(self, props):
+        """Replace the contents of the database by the runs in *props*."""
+        tmp_path = self.path.with_name(self.path.name + ".tmp")
+        tmp_path.unlink(missing_ok=True)
+        rows = (
+            (
+                run_id,
+                *(
+                    run.get(attr) if _is_sql_value(run.get(attr)) else None
+                    for attr in self.KEY_ATTRIBUTES
+                ),
+                json.dumps(run, cls=Properties._PropertiesEncoder, allow_nan=True),
+            )
+            for run_id, run in props.items()
+        )
+        with contextlib.closing(sqlite3.connect(tmp_path)) as connection:
+            connection.execute(
+                "CREATE TABLE runs (id TEXT PRIMARY KEY, domain, problem, "
+                "algorithm, properties TEXT NOT NULL)"
+            )
+            connection.executemany("INSERT INTO runs VALUES (?, ?, ?, ?, ?)", rows)
+            for attr in self.KEY_ATTRIBUTES:
+                connection.execute(f"CREATE INDEX runs_{attr} ON runs ({attr})")
+            connection.commit()
+        os.replace(tmp_path, self.path)
+
+    def load(self, **key_values):
+        """Return the runs whose key attributes have the given values.
+
+        Each keyword argument maps a key attribute to a value or a list
+        of allowed values, like the ``filter_*`` arguments of reports.
+
+        """
+        conditions = []
+        parameters = []
+        for attr, value in key_values.items():
+            if attr not in self.KEY_ATTRIBUTES:
+                raise ValueError(f"{attr} is not a key attribute")
+            values = list(value) if isinstance(value, list | tuple | set) else [value]
+            conditions.append(f"{attr} IN ({', '.join('?' * len(values))})")
+            parameters.extend(values)
+        query = "SELECT id, properties FROM runs"
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+        props = Properties()
+        with contextlib.closing(sqlite3.connect(self.path)) as connection:
+            for run_id, text in connection.execute(query, parameters):
+                props[run_id] = json.loads(text, allow_nan=True)
+        return props
+
+
+COLUMNS_FILENAME = "properties-columns.npz"
+
+
+def _get_column_kind(values):
+    """Return how to store the given non-missing values of an attribute."""
+    if all(isinstance(value, bool) for value in values):
+        return "bool"
+    if all(isinstance(value, int) and -(2**63) <= value < 2**63 for value in values):
+        return "int"
+    if all(isinstance(value, int | float) for value in values):
+        return "float"
+    if all(isinstance(value, str) for value in values):
+        return "str"
+    return "json"
+
+
+def _pack_strings(strings):
+    """Return the UTF-8 encoded *strings* as one byte array and offsets.
+
+    Unlike NumPy's fixed-width string arrays, this needs no padding, so a
+    single long value doesn't blow up the size of the whole column.
+
+    """
+    import numpy as np
+
+    encoded = [string.encode("utf-8") for string in strings]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(data) for data in encoded], dtype=np.int64)
+    return np.frombuffer(b"".join(encoded), dtype=np.uint8), offsets
+
+
+def _unpack_strings(data, offsets):
+    data = data.tobytes()
+    offsets = offsets.tolist()
+    return [
+        data[start:end].decode("utf-8")
+        for start, end in zip(offsets[:-1], offsets[1:], strict=True)
+    ]
+
+
+class ColumnarProperties:
+    """Read-only, column-oriented view of combined properties.
+
+    Reports aggregate attributes over many runs. Storing each attribute
+    as one NumPy array is much faster to load than decoding a dict for
+    each run. :meth:`write` exports properties to a ``.npz`` file and
+    indexing returns the values of an attribute as a masked array, in
+    the order of :attr:`run_ids`. Missing values are masked. Strings are
+    stored with a dictionary of distinct values, which are UTF-8 encoded
+    and concatenated into one byte array. Other non-numeric
+    values (e.g., lists) are stored as JSON. The columns can be passed
+    directly to pandas or polars:
+
+    >>> import pandas as pd  # doctest: +SKIP
+    >>> path = "exp-eval/properties-columns.npz"
+    >>> columns = ColumnarProperties(path)  # doctest: +SKIP
+    >>> data = {attr: columns[attr] for attr in columns.attributes}  # doctest: +SKIP
+    >>> df = pd.DataFrame(data)  # doctest: +SKIP
+
+    """
+
+    def __init__(self, path):
+        import numpy as np
+
+        self.path = Path(path)
+        self._arrays = np.load(self.path, allow_pickle=False)
+        self.run_ids = self._arrays["run_ids"].tolist()
+        self.attributes = self._arrays["attributes"].tolist()
+        self._kinds = dict(
+            zip(self.attributes, self._arrays["kinds"].tolist(), strict=True)
+        )
+
+    def __len__(self):
+        return len(self.run_ids)
+
+    def __contains__(self, attribute):
+        return attribute in self._kinds
+
+    def __getitem__(self, attribute):
+        import numpy as np
+
+        kind = self._kinds[attribute]
+        prefix = f"{self.attributes.index(attribute)}."
+        if kind in ["bool", "int", "float"]:
+            values = self._arrays[prefix + "values"]
+            mask = ~self._arrays[prefix + "present"]
+            return np.ma.MaskedArray(values, mask=mask)
+        codes = self._arrays[prefix + "codes"]
+        texts = _unpack_strings(
+            self._arrays[prefix + "categories"], self._arrays[prefix + "offsets"]
+        )
+        # Fill the array element-wise to keep lists as objects.
+        categories = np.empty(len(texts), dtype=object)
+        for code, text in enumerate(texts):
+            categories[code] = (
+                json.loads(text, allow_nan=True) if kind == "json" else text
+            )
+        values = categories[np.maximum(codes, 0)] if len(categories) else codes
+        return np.ma.MaskedArray(values, mask=codes < 0)
+
+    @staticmethod
+    def write(props, path):
+        """Write the runs in *props* column by column to *path*."""
+        import numpy as np
+
+        run_ids = sorted(props)
+        runs = [props[run_id] for run_id in run_ids]
+        attributes = sorted({attr for run in runs for attr in run})
+        arrays = {"run_ids": np.array(run_ids, dtype=str)}
+        kinds = []
+        for index, attribute in enumerate(attributes):
+            prefix = f"{index}."
+            present = np.array([attribute in run for run in runs], dtype=bool)
+            values = [run[attribute] for run in runs if attribute in run]
+            kind = _get_column_kind(values)
+            kinds.append(kind)
+            if kind in ["bool", "int", "float"]:
+                dtype = {"bool": bool, "int": np.int64, "float": np.float64}[kind]
+                column = np.zeros(len(runs), dtype=dtype)
+                column[present] = values
+                arrays[prefix + "values"] = column
+                arrays[prefix + "present"] = present
+                continue
+            if kind == "json":
+                values = [
+                    json.dumps(value, cls=Properties._PropertiesEncoder, allow_nan=True)
+                    for value in values
+                ]
+            categories = sorted(set(values))
+            category_codes = {value: code for code, value in enumerate(categories)}
+            codes = np.full(len(runs), -1, dtype=np.int32)
+            codes[present] = [category_codes[value] for value in values]
+            arrays[prefix + "codes"] = codes
+            data, offsets = _pack_strings(categories)
+            arrays[prefix + "categories"] = data
+            arrays[prefix + "offsets"] = offsets
+        arrays["attributes"] = np.array(attributes, dtype=str)
+        arrays["kinds"] = np.array(kinds, dtype=str)
+        np.savez(path, **arrays)
 
 
 class RunFilter:
     def __init__(self, filter, **kwargs):
         self.filters = make_list(filter)
         self.filtered_attributes = []  # Only needed for sanity checks.
+        self._attribute_values = {}
         for arg_name, arg_value in kwargs.items():
             if not arg_name.startswith("filter_"):
                 logging.critical(f'Invalid filter keyword argument name "{arg_name}"')
@@ -328,6 +1090,25 @@ class RunFilter:
             # Add a filter for the specified property.
             self.filters.append(self._build_filter(attribute, arg_value))
             self.filtered_attributes.append(attribute)
+            self._attribute_values[attribute] = arg_value
+
+    def get_key_filters(self, attributes):
+        """Return the ``filter_*`` values for the given *attributes*.
+
+        Storage backends can use them to skip non-matching runs before
+        loading them. This is only possible if there are no filter
+        functions, since these run first and may change any attribute.
+        The returned values are still checked by :meth:`apply`.
+
+        """
+        if len(self.filters) > len(self.filtered_attributes):
+            return {}
+        key_filters = {}
+        for attribute, value in self._attribute_values.items():
+            values = value if isinstance(value, list | tuple | set) else [value]
+            if attribute in attributes and values and all(map(_is_sql_value, values)):
+                key_filters[attribute] = value
+        return key_filters
 
     def _build_filter(self, prop, value):
         # Do not define this function inplace to force early binding.
@@ -349,10 +1130,11 @@ class RunFilter:
         # the filter returns True. In this case modified_run is not changed.
         modified_run = run
         result = filter_(modified_run)
-        if not isinstance(result, dict | bool):
+        if not isinstance(result, collections.abc.Mapping | bool):
             logging.critical("Filters must return a dictionary or Boolean")
-        # If a dict is returned, use it as the new run, otherwise take the old one.
-        if isinstance(result, dict):
+        # If a dict (or a RunRecord) is returned, use it as the new run,
+        # otherwise take the old one.
+        if isinstance(result, collections.abc.Mapping):
             modified_run = result
         if not result:
             # Discard runs that returned False or an empty dictionary.
@@ -367,8 +1149,10 @@ class RunFilter:
                     f'"filter_{attribute}"). Is this a typo?'
                 )
         for filter_ in self.filters:
-            for old_run_id, run in list(props.items()):
-                del props[old_run_id]
+            # Pop the runs one by one to avoid decoding all runs of
+            # LazyProperties at once.
+            for old_run_id in list(props):
+                run = props.pop(old_run_id)
                 new_run = self.apply_filter_to_run(filter_, run)
                 if new_run:
                     # Filters may change a run's ID. Don't complain if ID is missing.
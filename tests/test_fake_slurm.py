@@ -0,0 +1,183 @@
+"""
+Test the Slurm code path with the fake sbatch command in tests/fake-slurm.
+"""
+
+import json
+import os
+import subprocess
+import sys
+import textwrap
+import time
+from pathlib import Path
+
+import pytest
+
+from lab import tools
+
+FAKE_SLURM_DIR = Path(__file__).resolve().parent / "fake-slurm"
+LAB_DIR = Path(__file__).resolve().parents[1]
+
+EXPERIMENT_SCRIPT = """\
+#! /usr/bin/env python
+
+import sys
+
+from lab.environments import BaselSlurmEnvironment
+from lab.experiment import Experiment
+from lab.parser import Parser
+
+
+class FakeSlurmEnvironment(BaselSlurmEnvironment):
+    MAX_TASKS = 3
+
+
+CODE = {code!r}
+
+
+env = FakeSlurmEnvironment(export=["PATH", "PYTHONPATH"], {env_options})
+exp = Experiment(environment=env)
+parser = Parser()
+parser.add_pattern("value", r"value: (\\d+)", type=int, required=True)
+exp.add_parser(parser)
+for value in range({num_runs}):
+    run = exp.add_run()
+    run.add_command(
+        "print",
+        [sys.executable, "-c", CODE.replace("VALUE", str(value))],
+        memory_limit={memory_limit},
+    )
+    run.set_property("id", [f"run{{value}}"])
+    run.set_property("expected", value)
+exp.add_step("build", exp.build)
+exp.add_step("start", exp.start_runs)
+exp.add_step("parse", exp.parse)
+exp.add_fetcher(name="fetch")
+exp.run_steps()
+"""
+
+
+def run_experiment(
+    tmp_path,
+    num_runs=7,
+    env_options="",
+    memory_limit="None",
+    code="print('value: VALUE')",
+):
+    script = tmp_path / "exp.py"
+    script.write_text(
+        textwrap.dedent(
+            EXPERIMENT_SCRIPT.format(
+                num_runs=num_runs,
+                env_options=env_options,
+                memory_limit=memory_limit,
+                code=code,
+            )
+        )
+    )
+    state_dir = tmp_path / "fake-slurm-state"
+    env = dict(os.environ)
+    env["PATH"] = f"{FAKE_SLURM_DIR}{os.pathsep}{env['PATH']}"
+    env["PYTHONPATH"] = str(LAB_DIR)
+    env["FAKE_SLURM_DIR"] = str(state_dir)
+    env["FAKE_SLURM_PARALLELISM"] = "2"
+    env["FAKE_SLURM_NO_PROFILE"] = "1"
+    subprocess.check_call([sys.executable, str(script), "--all"], cwd=tmp_path, env=env)
+    job_ids = [path.stem for path in state_dir.glob("*.json")]
+    deadline = time.time() + 120
+    while not all((state_dir / f"{job_id}.done").exists() for job_id in job_ids):
+        if time.time() > deadline:
+            pytest.fail("fake Slurm jobs did not finish in time")
+        time.sleep(0.2)
+    return {
+        job_id: json.loads((state_dir / f"{job_id}.done").read_text())
+        for job_id in job_ids
+    }
+
+
+# Simulate a node failure in the first attempt of run 2: kill all processes
+# of the Slurm task that executes the run. Lab formats command arguments with
+# str.format(), so the code must not contain braces.
+KILL_TASK_CODE = """\
+import os, signal, sys
+from pathlib import Path
+flag = Path("FLAG")
+if VALUE == 1 and not flag.exists():
+    flag.touch()
+    pids = []
+    pid = os.getppid()
+    while b"--execute-job" not in Path("/proc/%d/cmdline" % pid).read_bytes():
+        pids.append(pid)
+        pid = int(Path("/proc/%d/stat" % pid).read_text().rsplit(")")[1].split()[1])
+    # Kill parents first, so that no shell can mark the run as finished.
+    for pid in reversed(pids):
+        os.kill(pid, signal.SIGKILL)
+    sys.exit(1)
+print('value: VALUE')
+"""
+
+
+def load_eval_properties(tmp_path):
+    return json.loads((tmp_path / "data" / "exp-eval" / "properties").read_text())
+
+
+def test_fake_slurm_experiment(tmp_path):
+    jobs = run_experiment(tmp_path)
+    # build, start, parse and fetch.
+    assert len(jobs) == 4
+    assert all(job["state"] == "COMPLETED" for job in jobs.values())
+    # Seven runs with at most three tasks use three runs per task.
+    assert sorted(job["num_tasks"] for job in jobs.values()) == [1, 1, 1, 3]
+    props = load_eval_properties(tmp_path)
+    assert len(props) == 7
+    for run in props.values():
+        assert run["value"] == run["expected"]
+        assert not tools.has_unexplained_error(run)
+
+
+def test_fake_slurm_parse_after_run(tmp_path):
+    run_experiment(tmp_path, env_options="parse_after_run=True")
+    slurm_log = (tmp_path / "data" / "exp-grid-steps" / "slurm.log").read_text()
+    assert "Skipped 7 unchanged runs." in slurm_log
+    props = load_eval_properties(tmp_path)
+    assert [run["value"] for run in props.values()] == list(range(7))
+
+
+def test_fake_slurm_group_runs_by_resources(tmp_path):
+    jobs = run_experiment(
+        tmp_path,
+        env_options='memory_per_cpu="1G", group_runs_by_resources=True',
+        memory_limit="2048 if value % 3 == 0 else None",
+    )
+    # build, two start jobs, parse and fetch.
+    assert len(jobs) == 5
+    assert all(job["state"] == "COMPLETED" for job in jobs.values())
+    job_dir = tmp_path / "data" / "exp-grid-steps"
+    run_ids = {}
+    for cpus in [1, 2]:
+        (job_file,) = job_dir.glob(f"*-start-{cpus}cpus")
+        job = job_file.read_text()
+        assert f"#SBATCH --cpus-per-task={cpus}" in job
+        [line] = [line for line in job.splitlines() if "SHUFFLED_RUN_IDS=(" in line]
+        run_ids[cpus] = sorted(int(i) for i in line.split("(")[1][:-1].split())
+    # Runs 1, 4 and 7 need two cores, the other four runs need one core.
+    assert run_ids == {1: [2, 3, 5, 6], 2: [1, 4, 7]}
+    props = load_eval_properties(tmp_path)
+    assert [run["value"] for run in props.values()] == list(range(7))
+
+
+def test_fake_slurm_retry_interrupted_runs(tmp_path):
+    jobs = run_experiment(
+        tmp_path,
+        env_options="max_retries=2",
+        code=KILL_TASK_CODE.replace("FLAG", str(tmp_path / "killed")),
+    )
+    # build, start, start-retry1, start-retry2, parse and fetch.
+    assert len(jobs) == 6
+    assert [job["state"] for job in jobs.values()].count("FAILED") == 1
+    slurm_log = (tmp_path / "data" / "exp-grid-steps" / "slurm.log").read_text()
+    assert slurm_log.count("was interrupted --> restart it") == 1
+    # The first retry finished all runs, so the second one is cancelled.
+    # The fake Slurm has no scancel, so each of its three tasks exits.
+    assert slurm_log.count("was interrupted --> cancel the retry") == 3
+    props = load_eval_properties(tmp_path)
+    assert [run["value"] for run in props.values()] == list(range(7))
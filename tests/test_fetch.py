@@ -0,0 +1,341 @@
+import json
+from pathlib import Path
+
+import pytest
+
+from lab import tools
+from lab.experiment import Experiment
+from lab.fetcher import Fetcher, get_results_log_entry
+
+from toy_experiments import NUM_RUNS, get_run_dirs
+from toy_experiments import make_experiment as make_toy_experiment
+
+
+def make_experiment(tmp_path):
+    exp = make_toy_experiment(tmp_path)
+    for index, run_dir in enumerate(get_run_dirs(exp)):
+        write_run_properties(run_dir, {"cost": index})
+        (run_dir / "driver.log").write_text("")
+    return exp
+
+
+def write_run_properties(run_dir, values):
+    props = tools.Properties(run_dir / "properties")
+    props.update(values)
+    props.write()
+
+
+def fetch(exp, eval_name, **kwargs):
+    eval_dir = Path(exp.path).parent / eval_name
+    Fetcher()(exp.path, eval_dir, merge=True, **kwargs)
+    return eval_dir
+
+
+def read_eval_properties(eval_dir):
+    return (eval_dir / "properties").read_text()
+
+
+@pytest.mark.parametrize("kwargs", [{"threads": 4}, {"processes": 3}])
+def test_parallel_fetch_matches_sequential_fetch(tmp_path, kwargs):
+    exp = make_experiment(tmp_path)
+    sequential = read_eval_properties(fetch(exp, "sequential-eval"))
+    parallel = read_eval_properties(fetch(exp, "parallel-eval", **kwargs))
+    assert parallel == sequential
+    props = tools.Properties(tmp_path / "parallel-eval" / "properties")
+    assert len(props) == NUM_RUNS
+    assert props["run05"]["cost"] == 5
+
+
+def test_incremental_fetch_reads_only_changed_runs(tmp_path, monkeypatch):
+    exp = make_experiment(tmp_path)
+    eval_dir = fetch(exp, "eval")
+    assert (eval_dir / "fetch-index.json").is_file()
+
+    fetched_dirs = []
+    fetch_dir = Fetcher.fetch_dir
+
+    def recording_fetch_dir(self, run_dir):
+        fetched_dirs.append(Path(run_dir).name)
+        return fetch_dir(self, run_dir)
+
+    monkeypatch.setattr(Fetcher, "fetch_dir", recording_fetch_dir)
+    run_dirs = get_run_dirs(exp)
+    write_run_properties(run_dirs[3], {"cost": 42})
+    (run_dirs[7] / "run.err").write_text("error\n")
+    fetch(exp, "eval")
+    assert fetched_dirs == [run_dirs[3].name, run_dirs[7].name]
+    props = tools.Properties(eval_dir / "properties")
+    assert len(props) == NUM_RUNS
+    assert props["run03"]["cost"] == 42
+    assert props["run04"]["cost"] == 4
+    assert tools.has_unexplained_error(props["run07"])
+
+    # Filtered fetches read all runs and invalidate the index.
+    fetched_dirs.clear()
+    fetch(exp, "eval", filter_cost=42)
+    assert len(fetched_dirs) == NUM_RUNS
+    assert not (eval_dir / "fetch-index.json").exists()
+
+
+@pytest.mark.parametrize("archive_format", ["zip", "tar"])
+def test_fetch_from_archived_shards(tmp_path, archive_format):
+    exp = make_experiment(tmp_path)
+    (get_run_dirs(exp)[4] / "run.err").write_text("error\n")
+    expected = read_eval_properties(fetch(exp, "dir-eval"))
+    exp.archive_runs(archive_format=archive_format)
+    assert get_run_dirs(exp) == []
+    assert (Path(exp.path) / f"runs-00001-00100.{archive_format}").is_file()
+    assert read_eval_properties(fetch(exp, "archive-eval")) == expected
+
+
+def test_archive_runs_skips_unparsed_shards(tmp_path):
+    exp = make_experiment(tmp_path)
+    (get_run_dirs(exp)[0] / "properties").unlink()
+    exp.archive_runs()
+    assert len(get_run_dirs(exp)) == NUM_RUNS
+    assert not list(Path(exp.path).glob("runs-*-*.zip"))
+
+
+def test_fetch_keeps_head_and_tail_of_big_error_logs(tmp_path):
+    exp = make_experiment(tmp_path)
+    run_dirs = get_run_dirs(exp)
+    big_log = "first line\n" + "x" * 100_000 + "\nlast line\n"
+    for run_dir in run_dirs[:2]:
+        (run_dir / "run.err").write_text(big_log)
+    (run_dirs[2] / "driver.err").write_text("small error\n")
+    props = tools.Properties(fetch(exp, "eval") / "properties")
+    [error0] = props["run00"]["unexplained_errors"]
+    [error1] = props["run01"]["unexplained_errors"]
+    assert error0 == error1
+    assert error0.startswith("run.err: first line\n")
+    assert error0.endswith("\nlast line\n")
+    assert "full log has 100022 bytes" in error0
+    assert len(error0) < 20_000
+    assert props["run02"]["unexplained_errors"] == ["driver.err: small error\n"]
+
+
+def make_second_experiment(tmp_path):
+    exp = Experiment(path=str(tmp_path / "other"))
+    for index in [5, 20]:
+        run = exp.add_run()
+        run.add_command("solve", ["solver"])
+        run.set_property("id", [f"run{index:02d}"])
+    exp.build()
+    for run_dir in get_run_dirs(exp):
+        write_run_properties(run_dir, {"cost": 100})
+        (run_dir / "driver.log").write_text("")
+    return exp
+
+
+def fetch_sources(tmp_path, exps, **kwargs):
+    eval_dir = tmp_path / "combined-eval"
+    Fetcher()([exp.path for exp in exps], eval_dir, merge=False, **kwargs)
+    return tools.Properties(eval_dir / "properties")
+
+
+def test_fetch_multiple_sources_aborts_on_id_conflict(tmp_path):
+    exps = [make_experiment(tmp_path), make_second_experiment(tmp_path)]
+    with pytest.raises(SystemExit):
+        fetch_sources(tmp_path, exps)
+
+
+@pytest.mark.parametrize(
+    "conflicts, num_runs, cost5",
+    [("first", NUM_RUNS + 1, 5), ("newest", NUM_RUNS + 1, 100)],
+)
+def test_fetch_multiple_sources_resolves_conflicts(
+    tmp_path, conflicts, num_runs, cost5
+):
+    exps = [make_experiment(tmp_path), make_second_experiment(tmp_path)]
+    props = fetch_sources(tmp_path, exps, conflicts=conflicts, threads=2)
+    assert len(props) == num_runs
+    assert props["run05"]["cost"] == cost5
+    assert props["run20"]["cost"] == 100
+
+
+def test_fetch_multiple_sources_with_prefix(tmp_path):
+    exps = [make_experiment(tmp_path), make_second_experiment(tmp_path)]
+    props = fetch_sources(tmp_path, exps, conflicts="prefix")
+    assert len(props) == NUM_RUNS + 2
+    assert props["exp-run05"]["cost"] == 5
+    assert props["other-run05"]["cost"] == 100
+    assert props["other-run05"]["id"] == ["other", "run05"]
+
+
+@pytest.mark.parametrize("conflicts", ["error", "prefix"])
+def test_fetch_eval_dir_with_runs_without_id(tmp_path, conflicts):
+    # Like the results of examples/report-external-results.py.
+    src_dir = tmp_path / "external-eval"
+    src_dir.mkdir()
+    (src_dir / "properties").write_text(
+        json.dumps({"ff-gripper": {"algorithm": "ff", "coverage": 1}})
+    )
+    exp = make_experiment(tmp_path)
+    eval_dir = tmp_path / "combined-eval"
+    Fetcher()([src_dir, exp.path], eval_dir, merge=False, conflicts=conflicts)
+    props = tools.Properties(eval_dir / "properties")
+    assert len(props) == NUM_RUNS + 1
+    run_id = "ff-gripper" if conflicts == "error" else "external-eval-ff-gripper"
+    assert props[run_id] == {"algorithm": "ff", "coverage": 1}
+    assert "id" not in props[run_id]
+
+
+def test_fetch_into_database(tmp_path):
+    exp = make_experiment(tmp_path)
+    expected = tools.Properties(fetch(exp, "json-eval") / "properties")
+    eval_dir = fetch(exp, "db-eval", database=True)
+    assert not (eval_dir / "properties").exists()
+    database = tools.PropertiesDatabase(eval_dir / "properties.sqlite")
+    assert database.load() == expected
+
+    # Merging into a database keeps the runs stored in it.
+    write_run_properties(get_run_dirs(exp)[0], {"cost": 42})
+    fetch(exp, "db-eval", database=True)
+    assert len(database.load()) == NUM_RUNS
+    assert database.load()["run00"]["cost"] == 42
+
+
+def test_database_selects_runs_by_key_attributes(tmp_path):
+    props = tools.Properties()
+    for algo in ["a", "b"]:
+        for domain in ["d1", "d2", "d3"]:
+            run_id = [algo, domain]
+            props["-".join(run_id)] = {
+                "id": run_id,
+                "algorithm": algo,
+                "domain": domain,
+                "cost": float("nan"),
+            }
+    database = tools.PropertiesDatabase(tmp_path / "properties.sqlite")
+    database.write(props)
+    assert sorted(database.load(algorithm="b", domain=["d1", "d3"])) == [
+        "b-d1",
+        "b-d3",
+    ]
+    assert len(database.load()) == 6
+
+
+def test_run_filter_key_filters():
+    run_filter = tools.RunFilter(None, filter_domain=["d1"], filter_cost=3)
+    assert run_filter.get_key_filters(["domain"]) == {"domain": ["d1"]}
+    # Filter functions may change attributes before filter_* are applied.
+    run_filter = tools.RunFilter(lambda run: run, filter_domain="d1")
+    assert run_filter.get_key_filters(["domain"]) == {}
+
+
+def test_fetch_exports_columns(tmp_path):
+    exp = make_experiment(tmp_path)
+    (get_run_dirs(exp)[1] / "run.err").write_text("error\n")
+    write_run_properties(get_run_dirs(exp)[2], {"cost": 2.5, "name": "x"})
+    eval_dir = fetch(exp, "eval", columns=True)
+    props = tools.Properties(eval_dir / "properties")
+    columns = tools.ColumnarProperties(eval_dir / "properties-columns.npz")
+    assert columns.run_ids == sorted(props)
+    assert len(columns) == NUM_RUNS
+    costs = columns["cost"]
+    assert costs.tolist() == [props[run_id]["cost"] for run_id in columns.run_ids]
+    names = columns["name"]
+    assert names.count() == 1
+    assert names[2] == "x"
+    assert columns["id"][3] == ["run03"]
+    errors = columns["unexplained_errors"]
+    assert errors.count() == 1
+    assert errors[1] == ["run.err: error\n"]
+    assert "missing" not in columns
+
+
+def test_columns_store_strings_without_padding(tmp_path):
+    long_name = "ä" * 10_000
+    props = tools.Properties()
+    for index in range(100):
+        props[f"run{index:03d}"] = {"name": long_name if index == 0 else "x"}
+    path = tmp_path / "properties-columns.npz"
+    tools.ColumnarProperties.write(props, path)
+    columns = tools.ColumnarProperties(path)
+    assert columns["name"].tolist() == [long_name] + ["x"] * 99
+    assert path.stat().st_size < 50_000
+
+
+def test_compact_fetch(tmp_path):
+    exp = make_experiment(tmp_path)
+    expected = tools.Properties(fetch(exp, "pretty-eval") / "properties")
+    eval_dir = fetch(exp, "compact-eval", compact=True)
+    assert "\n" not in read_eval_properties(eval_dir)
+    assert tools.Properties(eval_dir / "properties") == expected
+
+
+@pytest.mark.parametrize("compression", ["xz", "zst"])
+def test_fetch_writes_compressed_properties(tmp_path, compression):
+    if compression == "zst" and tools.zstd is None:
+        pytest.skip("zstd support is not installed")
+    exp = make_experiment(tmp_path)
+    expected = tools.Properties(fetch(exp, "eval") / "properties")
+    eval_dir = fetch(exp, "eval", compression=compression, threads=2)
+    assert not (eval_dir / "properties").exists()
+    assert (eval_dir / f"properties.{compression}").is_file()
+    assert tools.Properties(eval_dir / "properties") == expected
+    # Fetching again keeps the compressed format.
+    fetch(exp, "eval")
+    assert tools.Properties(eval_dir / "properties").path.suffix == f".{compression}"
+
+
+def append_to_results_log(run_dir, **changes):
+    log_path = run_dir.parent / "results.jsonl"
+    entry = get_results_log_entry(run_dir)
+    entry["properties"].update(changes)
+    tools.append_json_line(log_path, entry)
+    return log_path
+
+
+def test_fetch_reads_results_logs(tmp_path):
+    exp = make_experiment(tmp_path)
+    run_dirs = get_run_dirs(exp)
+    expected = tools.Properties(fetch(exp, "dir-eval") / "properties")
+    for run_dir in run_dirs[:5]:
+        append_to_results_log(run_dir)
+    # The last line for a run wins. Marking logged runs shows that the
+    # fetcher takes them from the log.
+    for run_dir in run_dirs[:4]:
+        log_path = append_to_results_log(run_dir, logged=True)
+    for run_id in ["run00", "run01", "run02"]:
+        expected[run_id]["logged"] = True
+    # Runs whose files changed after logging them are fetched from their
+    # run dirs.
+    write_run_properties(run_dirs[3], {"cost": 42})
+    expected["run03"]["cost"] = 42
+    # So are runs with entries without fingerprint and invalid lines.
+    entry = get_results_log_entry(run_dirs[4])
+    del entry["fingerprint"]
+    entry["properties"]["logged"] = True
+    tools.append_json_line(log_path, entry)
+    with open(log_path, "a") as f:
+        f.write('{"run_dir": "00006", "properties": {"id": ["broken"\n')
+    assert tools.Properties(fetch(exp, "log-eval") / "properties") == expected
+
+
+def write_results_log_lines(args):
+    log_path, index = args
+    tools.append_json_line(log_path, {"run_dir": str(index), "text": "x" * 10000})
+
+
+def test_concurrent_appends_to_results_log(tmp_path):
+    log_path = tmp_path / "results.jsonl"
+    tasks = [(log_path, index) for index in range(200)]
+    list(tools.map_parallel(write_results_log_lines, tasks, processes=4))
+    lines = log_path.read_text().splitlines()
+    assert sorted(int(json.loads(line)["run_dir"]) for line in lines) == list(
+        range(200)
+    )
+
+
+def test_changed_conflict_policy_invalidates_index(tmp_path):
+    exp = make_experiment(tmp_path)
+    eval_dir = fetch(exp, "eval", conflicts="prefix")
+    write_run_properties(get_run_dirs(exp)[3], {"cost": 42})
+    fetch(exp, "eval")
+    props = tools.Properties(eval_dir / "properties")
+    # All runs are fetched again with their unprefixed IDs.
+    assert len(props) == 2 * NUM_RUNS
+    assert props["exp-run03"]["cost"] == 3
+    assert props["run03"]["cost"] == 42
+    assert props["run04"]["cost"] == 4
@@ -0,0 +1,298 @@
+import json
+import logging
+import re
+import sys
+from pathlib import Path
+
+import pytest
+
+from lab import tools
+from lab.fetcher import Fetcher
+from lab.parser import Parser, _get_callable_fingerprint, parse_run
+
+from toy_experiments import NUM_RUNS, get_run_dirs
+from toy_experiments import make_experiment as make_toy_experiment
+
+
+def count_lines(content, props):
+    props["lines"] = len(content.splitlines())
+
+
+def make_experiment(tmp_path):
+    parser = Parser()
+    parser.add_pattern("value", r"value: (\d+)", type=int, required=True)
+    parser.add_pattern("time", r"time: (.+)s", type=float)
+    parser.add_function(count_lines)
+    exp = make_toy_experiment(tmp_path, parsers=[parser])
+    for index, run_dir in enumerate(get_run_dirs(exp)):
+        (run_dir / "run.log").write_text(f"value: {index}\ntime: {index / 10}s\n")
+    return exp
+
+
+def read_properties(exp):
+    return [(run_dir / "properties").read_text() for run_dir in get_run_dirs(exp)]
+
+
+@pytest.mark.parametrize("processes", [2, 3])
+def test_parallel_parse_matches_sequential_parse(tmp_path, processes):
+    exp = make_experiment(tmp_path)
+    exp.parse()
+    sequential = read_properties(exp)
+    for run_dir in get_run_dirs(exp):
+        (run_dir / "properties").unlink()
+    exp.parse(processes=processes)
+    assert read_properties(exp) == sequential
+    props = tools.Properties(get_run_dirs(exp)[5] / "properties")
+    assert props["value"] == 5
+    assert props["lines"] == 2
+
+
+def test_parallel_parse_aborts_on_critical_error(tmp_path):
+    exp = make_experiment(tmp_path)
+    run_dir = get_run_dirs(exp)[3]
+    (run_dir / "run.log").write_text("no value\n")
+
+    def fail_without_value(content, props):
+        if "value" not in props:
+            logging.critical("missing value")
+
+    exp.parsers[0].add_function(fail_without_value)
+    with pytest.raises(SystemExit):
+        exp.parse(processes=2)
+
+
+def test_map_parallel_keeps_order():
+    assert list(tools.map_parallel(abs, range(-20, 0), processes=3)) == list(
+        range(20, 0, -1)
+    )
+
+
+def mark_properties(exp):
+    """Overwrite all properties files to detect which runs are parsed again."""
+    for run_dir in get_run_dirs(exp):
+        (run_dir / "properties").write_text("{}")
+
+
+def get_parsed_runs(exp):
+    return [index for index, text in enumerate(read_properties(exp)) if text != "{}"]
+
+
+def test_parse_skips_unchanged_runs(tmp_path):
+    exp = make_experiment(tmp_path)
+    exp.parse()
+    mark_properties(exp)
+    exp.parse()
+    assert get_parsed_runs(exp) == []
+
+    # Changing the output of a run only reparses this run.
+    (get_run_dirs(exp)[2] / "run.log").write_text("value: 42\n")
+    exp.parse()
+    assert get_parsed_runs(exp) == [2]
+    assert tools.Properties(get_run_dirs(exp)[2] / "properties")["value"] == 42
+
+    # Changing a parser reparses all runs.
+    mark_properties(exp)
+    exp.parsers[0].add_pattern("other", r"other: (\d+)")
+    exp.parse()
+    assert get_parsed_runs(exp) == list(range(NUM_RUNS))
+
+
+def test_parse_with_force_parses_all_runs(tmp_path):
+    exp = make_experiment(tmp_path)
+    exp.parse()
+    mark_properties(exp)
+    exp.parse(force=True)
+    assert get_parsed_runs(exp) == list(range(NUM_RUNS))
+
+
+def test_parser_fingerprint_covers_used_globals():
+    namespace = {"re": re, "KEYS": ["value"]}
+    exec(
+        "def helper(content):\n"
+        "    return re.findall(r'value: (\\d+)', content)\n"
+        "def parse(content, props):\n"
+        "    props[KEYS[0]] = helper(content)\n",
+        namespace,
+    )
+    parse = namespace["parse"]
+    fingerprint = _get_callable_fingerprint(parse)
+    assert _get_callable_fingerprint(parse) == fingerprint
+    namespace["KEYS"] = ["other"]
+    assert _get_callable_fingerprint(parse) != fingerprint
+    namespace["KEYS"] = ["value"]
+    exec("def helper(content):\n    return []\n", namespace)
+    assert _get_callable_fingerprint(parse) != fingerprint
+
+
+def test_parse_run_reads_each_file_once(tmp_path, monkeypatch):
+    (tmp_path / "run.log").write_text("value: 3\ntime: 0.5s\n")
+    parser1 = Parser()
+    parser1.add_pattern("value", r"value: (\d+)", type=int)
+    parser2 = Parser()
+    parser2.add_pattern("time", r"time: (.+)s", type=float)
+    parser2.add_function(count_lines)
+
+    read_paths = []
+    read_text = Path.read_text
+
+    def counting_read_text(path, *args, **kwargs):
+        read_paths.append(path.name)
+        return read_text(path, *args, **kwargs)
+
+    monkeypatch.setattr(Path, "read_text", counting_read_text)
+    props = tools.Properties()
+    parse_run([parser1, parser2], tmp_path, props)
+    assert read_paths == ["run.log"]
+    assert props == {"value": 3, "time": 0.5, "lines": 2}
+
+
+@pytest.mark.parametrize(
+    "content", ["value: 7\ntime: 1.5s\nname: äöü\n", "no values\n", ""]
+)
+def test_mmap_parser_matches_str_parser(tmp_path, content):
+    (tmp_path / "run.log").write_text(content)
+    results = []
+    for use_mmap in [False, True]:
+        parser = Parser(use_mmap=use_mmap)
+        parser.add_pattern("value", r"value: (\d+)", type=int, required=True)
+        parser.add_pattern("time", r"time: (.+)s", type=float)
+        parser.add_pattern("name", r"name: (.+)\n", type=str)
+        parser.add_pattern(
+            "missing", r"missing: (.+)", file="missing.log", required=True
+        )
+        parser.add_function(count_lines)
+        props = tools.Properties()
+        parser.parse(tmp_path, props)
+        results.append(props)
+    assert results[0] == results[1]
+
+
+@pytest.mark.parametrize("use_mmap", [False, True])
+def test_match_modes(tmp_path, monkeypatch, use_mmap):
+    monkeypatch.setattr("lab.parser.LAST_MATCH_BLOCK_SIZE", 16)
+    lines = [f"cost: {cost}\n" for cost in [3, 2, 1]] + ["filler line\n"] * 20
+    (tmp_path / "run.log").write_text("".join(lines))
+    parser = Parser(use_mmap=use_mmap)
+    for match in ["first", "last", "all"]:
+        parser.add_pattern(match, r"cost: (\d+)", match=match)
+        parser.add_pattern(f"missing_{match}", r"missing: (\d+)", match=match)
+    props = tools.Properties()
+    parser.parse(tmp_path, props)
+    assert props == {"first": 3, "last": 1, "all": [3, 2, 1], "missing_all": []}
+
+
+def test_invalid_match_mode():
+    with pytest.raises(ValueError):
+        Parser().add_pattern("cost", r"cost: (\d+)", match="second")
+
+
+def test_parse_with_threads_matches_sequential_parse(tmp_path):
+    exp = make_experiment(tmp_path)
+    exp.parse()
+    sequential = read_properties(exp)
+    exp.parse(force=True, threads=4)
+    assert read_properties(exp) == sequential
+
+
+def test_functions_with_run_dir_keep_working_directory(tmp_path):
+    (tmp_path / "run.log").write_text("value: 3\n")
+    (tmp_path / "extra.txt").write_text("extra\n")
+    cwd = Path.cwd()
+
+    def read_extra(content, props, run_dir):
+        assert Path.cwd() == cwd
+        props["extra"] = (run_dir / "extra.txt").read_text().strip()
+
+    parser = Parser()
+    parser.add_function(read_extra, pass_run_dir=True)
+    props = tools.Properties()
+    parser.parse(tmp_path, props)
+    assert props == {"extra": "extra"}
+
+
+def test_failing_function_restores_working_directory(tmp_path):
+    (tmp_path / "run.log").write_text("")
+    cwd = Path.cwd()
+
+    def fail(content, props):
+        raise ValueError("parse error")
+
+    parser = Parser()
+    parser.add_function(fail)
+    with pytest.raises(ValueError):
+        parser.parse(tmp_path, tools.Properties())
+    assert Path.cwd() == cwd
+
+
+def test_map_parallel_with_threads_keeps_order():
+    assert list(tools.map_parallel(abs, range(-20, 0), threads=3)) == list(
+        range(20, 0, -1)
+    )
+
+
+@pytest.mark.parametrize("processes", [1, 2])
+def test_parse_profile(tmp_path, processes):
+    exp = make_experiment(tmp_path)
+    exp.parse(processes=processes, profile=True)
+    stats = json.loads((Path(exp.path) / "parse-profile.json").read_text())
+    calls = {entry["task"]: entry["calls"] for entry in stats}
+    assert calls == {
+        "read run.log": NUM_RUNS,
+        r"pattern run.log: value: (\d+)": NUM_RUNS,
+        "pattern run.log: time: (.+)s": NUM_RUNS,
+        "function test_parse.count_lines": NUM_RUNS,
+    }
+    times = [entry["time"] for entry in stats]
+    assert times == sorted(times, reverse=True)
+
+
+@pytest.mark.parametrize("use_mmap", [False, True])
+@pytest.mark.parametrize("suffix", [".xz", ".gz"])
+def test_parse_compressed_log(tmp_path, suffix, use_mmap):
+    content = "value: 7\ntime: 1.5s\n" + "filler\n" * 1000
+    with tools.open_compressed(tmp_path / f"run.log{suffix}", "wt") as f:
+        f.write(content)
+    parser = Parser(use_mmap=use_mmap)
+    parser.add_pattern("value", r"value: (\d+)", type=int, required=True)
+    parser.add_pattern("time", r"time: (.+)s", type=float, match="last")
+    parser.add_function(count_lines)
+    props = tools.Properties()
+    parser.parse(tmp_path, props)
+    assert props == {"value": 7, "time": 1.5, "lines": 1002}
+
+
+def test_parse_writes_results_log(tmp_path, monkeypatch):
+    exp = make_experiment(tmp_path)
+    run_dirs = get_run_dirs(exp)
+    exp.parse(threads=4, results_log=True)
+    log_path = run_dirs[0].parent / "results.jsonl"
+    lines = log_path.read_text().splitlines()
+    assert len(lines) == NUM_RUNS
+    entries = {entry["run_dir"]: entry for entry in map(json.loads, lines)}
+    assert entries[run_dirs[5].name]["properties"]["value"] == 5
+
+    eval_dir = tmp_path / "eval"
+    monkeypatch.setattr(
+        Fetcher, "fetch_dir", lambda self, run_dir: pytest.fail("run dir read")
+    )
+    Fetcher()(exp.path, eval_dir)
+    monkeypatch.undo()
+    props = tools.Properties(eval_dir / "properties")
+    assert len(props) == NUM_RUNS
+    assert props["run05"]["value"] == 5
+    assert props["run05"]["lines"] == 2
+
+    # Without results_log, outdated logs are removed.
+    exp.parse()
+    assert not log_path.exists()
+
+
+def test_parse_after_run_uses_parse_step_options(tmp_path, monkeypatch):
+    exp = make_experiment(tmp_path)
+    exp.add_step("parse", exp.parse, compact=True, results_log=True)
+    run_dir = get_run_dirs(exp)[3]
+    monkeypatch.setattr(sys, "argv", ["exp.py", "--parse-run-dir", str(run_dir)])
+    exp.run_steps()
+    assert "\n" not in (run_dir / "properties").read_text().strip()
+    [line] = (run_dir.parent / "results.jsonl").read_text().splitlines()
+    assert json.loads(line)["properties"]["value"] == 3
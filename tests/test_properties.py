@@ -0,0 +1,174 @@
+import math
+from pathlib import Path
+from types import SimpleNamespace
+
+import pytest
+
+from lab import tools
+
+
+@pytest.mark.parametrize("use_orjson", [False, True])
+def test_compact_properties_roundtrip(tmp_path, monkeypatch, use_orjson):
+    if use_orjson:
+        pytest.importorskip("orjson")
+    else:
+        monkeypatch.setattr(tools, "orjson", None)
+    props = tools.Properties(tmp_path / "properties", compact=True)
+    props["run1"] = {"id": ["run1"], "cost": 3, "path": Path("/a")}
+    props["run2"] = {"id": ["run2"], "time": 1.5}
+    props.write()
+    text = (tmp_path / "properties").read_text()
+    assert "\n" not in text
+    assert tools.Properties(tmp_path / "properties") == {
+        "run1": {"id": ["run1"], "cost": 3, "path": "/a"},
+        "run2": {"id": ["run2"], "time": 1.5},
+    }
+
+    # Non-finite floats survive, also when orjson is installed.
+    props["run2"]["time"] = math.inf
+    props.write()
+    assert tools.Properties(tmp_path / "properties")["run2"]["time"] == math.inf
+
+
+@pytest.mark.parametrize("level", [None, 5])
+@pytest.mark.parametrize("threads", [1, 4])
+def test_stdlib_zstd_options(tmp_path, monkeypatch, level, threads):
+    opened = []
+
+    def open_zstd(path, mode, level=None, options=None):
+        # Like compression.zstd in Python 3.14.
+        if level is not None and options is not None:
+            raise TypeError("only one of level or options may be passed")
+        opened.append((level, options))
+        return open(path, mode)
+
+    parameters = SimpleNamespace(nb_workers="workers", compression_level="level")
+    fake_zstd = SimpleNamespace(
+        __name__="compression.zstd", CompressionParameter=parameters, open=open_zstd
+    )
+    monkeypatch.setattr(tools, "zstd", fake_zstd)
+    path = tmp_path / "properties.zst"
+    with tools.open_compressed_for_writing(path, level=level, threads=threads) as f:
+        f.write(b"{}")
+    if threads == 1:
+        assert opened == [(level, None)]
+    else:
+        options = {"workers": threads}
+        if level is not None:
+            options["level"] = level
+        assert opened == [(None, options)]
+
+
+def test_pretty_print_properties(tmp_path):
+    props = tools.Properties(tmp_path / "properties", compact=True)
+    props["run1"] = {"id": ["run1"], "b": 2, "a": 1}
+    props.write()
+    tools.pretty_print_properties(tmp_path / "properties", tmp_path / "pretty")
+    assert (tmp_path / "pretty").read_text() == f"{props}\n"
+    assert '  "run1": {\n' in (tmp_path / "pretty").read_text()
+
+
+@pytest.mark.parametrize("suffix", ["", ".xz", ".gz", ".zst"])
+@pytest.mark.parametrize("threads", [1, 2])
+def test_compressed_properties_roundtrip(tmp_path, suffix, threads):
+    if suffix == ".zst" and tools.zstd is None:
+        pytest.skip("zstd support is not installed")
+    props = tools.Properties(
+        tmp_path / f"properties{suffix}",
+        compression_level=1,
+        compression_threads=threads,
+    )
+    props["run1"] = {"id": ["run1"], "cost": 3, "time": math.nan}
+    props.write()
+    assert tools.Properties.exists(tmp_path / "properties")
+    # The compressed variant is found for the uncompressed filename.
+    loaded = tools.Properties(tmp_path / "properties")
+    assert loaded.path == tmp_path / f"properties{suffix}"
+    assert loaded["run1"]["cost"] == 3
+    assert math.isnan(loaded["run1"]["time"])
+
+
+@pytest.mark.parametrize("compact", [False, True])
+def test_lazy_properties(tmp_path, compact):
+    props = tools.Properties(tmp_path / "properties.xz", compact=compact)
+    props['run "1"'] = {"id": ["a", "b"], "text": 'x}, "y": [{', "time": math.inf}
+    props["run2"] = {"id": ["run2"], "nested": {"list": [1, [2, {}]], "empty": []}}
+    props["run3"] = {}
+    props.write()
+
+    lazy = tools.LazyProperties(tmp_path / "properties")
+    assert len(lazy) == 3 and "run3" in lazy
+    # Runs in indented files are only decoded on access.
+    assert isinstance(lazy._runs["run2"], slice) != compact
+    assert dict(lazy.items()) == props
+    assert lazy['run "1"']["time"] == math.inf
+
+
+def test_lazy_properties_decode_runs_on_access(tmp_path, monkeypatch):
+    props = tools.Properties(tmp_path / "properties")
+    for index in range(10):
+        props[f"run{index}"] = {"id": [f"run{index}"], "algorithm": f"algo{index % 2}"}
+    props.write()
+    lazy = tools.LazyProperties(tmp_path / "properties")
+    decoded = []
+    load_json = tools._load_json
+
+    def count_load_json(content):
+        decoded.append(content)
+        return load_json(content)
+
+    monkeypatch.setattr(tools, "_load_json", count_load_json)
+    lazy["run4"]["cost"] = 1
+    assert lazy["run4"]["cost"] == 1
+    assert len(decoded) == 1
+    del lazy["run5"]
+    assert len(decoded) == 1
+
+    assert lazy._content
+    tools.RunFilter(None, filter_algorithm="algo0").apply(lazy)
+    assert sorted(lazy) == ["run0", "run2", "run4", "run6", "run8"]
+    assert lazy["run4"]["cost"] == 1
+    # All remaining runs are decoded, so the file content is released.
+    assert lazy._content == b""
+
+
+def test_loaded_strings_are_interned(tmp_path):
+    props = tools.Properties(tmp_path / "properties")
+    for index in range(2):
+        props[f"run{index}"] = {"id": ["lama", f"p{index}"], "algorithm": "lama"}
+    props.write()
+    for loaded in [
+        tools.Properties(tmp_path / "properties", intern_strings=True),
+        tools.LazyProperties(tmp_path / "properties", intern_strings=True),
+    ]:
+        run0, run1 = loaded["run0"], loaded["run1"]
+        assert run0["algorithm"] is run1["algorithm"] is run0["id"][0]
+        assert next(iter(run0)) is next(iter(run1))
+
+
+@pytest.mark.parametrize("compact", [False, True])
+def test_run_records(tmp_path, compact):
+    props = tools.Properties(tmp_path / "properties", compact=compact)
+    props["run1"] = {"id": ["run1"], "algorithm": "a", "time": math.inf}
+    props["run2"] = {"id": ["run2"], "algorithm": "b", "time": 2.0}
+    props.write()
+
+    records = tools.Properties(tmp_path / "properties", run_records=True)
+    run1, run2 = records["run1"], records["run2"]
+    assert isinstance(run1, tools.RunRecord)
+    assert run1._index is run2._index
+    # Only the records of one file share layouts.
+    other_records = tools.Properties(tmp_path / "properties", run_records=True)
+    assert other_records["run1"]._index is not run1._index
+    assert run1 == props["run1"] and "time" in run1 and len(run1) == 3
+    with pytest.raises(TypeError):
+        run1["cost"] = 1
+
+    # Records are written as normal runs.
+    records.write()
+    assert tools.Properties(tmp_path / "properties") == props
+
+    lazy = tools.LazyProperties(tmp_path / "properties", run_records=True)
+    tools.RunFilter(None, filter_algorithm="b").apply(lazy)
+    assert list(lazy) == ["run2"]
+    assert isinstance(lazy["run2"], tools.RunRecord)
@@ -21,3 +21,50 @@ def test_geometric_mean1(values):
     assert round(geometric_mean_old(values), 2) == round(
         reports.geometric_mean(values), 2
     )
+
+
+@pytest.mark.parametrize("database", [False, True])
+def test_report_loads_filtered_runs(tmp_path, database):
+    props = tools.Properties(tmp_path / "properties")
+    for algo in ["a", "b"]:
+        for domain in ["d1", "d2"]:
+            props[f"{algo}-{domain}"] = {
+                "id": [algo, domain],
+                "algorithm": algo,
+                "domain": domain,
+                "problem": "p1",
+                "cost": 1,
+            }
+    if database:
+        tools.PropertiesDatabase(tmp_path / "properties.sqlite").write(props)
+    else:
+        props.write()
+    report = reports.Report(filter_algorithm="b")
+    report.eval_dir = str(tmp_path)
+    report._load_data()
+    if not database:
+        # Lazy loading lets filter_* arguments drop runs after decoding them.
+        assert isinstance(report.props, tools.LazyProperties)
+    report._apply_filter()
+    assert sorted(report.props) == ["b-d1", "b-d2"]
+
+
+def test_report_loads_run_records(tmp_path):
+    props = tools.Properties(tmp_path / "properties")
+    for algo in ["a", "b"]:
+        props[algo] = {"id": [algo], "algorithm": algo, "cost": 1}
+    props.write()
+
+    def rename_algorithm(run):
+        return {**run, "algorithm": run["algorithm"].upper()}
+
+    report = reports.Report(
+        filter=[lambda run: run, rename_algorithm], run_records=True
+    )
+    report.eval_dir = str(tmp_path)
+    report._load_data()
+    # Filter functions need all runs, so they are loaded eagerly.
+    assert isinstance(report.props, tools.Properties)
+    assert isinstance(report.props["a"], tools.RunRecord)
+    report._apply_filter()
+    assert [run["algorithm"] for run in report.props.values()] == ["A", "B"]
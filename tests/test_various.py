@@ -1,7 +1,16 @@
 import datetime
 import os
+import subprocess
+import sys
+from pathlib import Path
 
+import pytest
+
+import lab
 from lab import tools
+from lab.calls import staging
+from lab.environments import SlurmEnvironment
+from lab.experiment import Experiment
 
 base = os.path.join("/tmp", str(datetime.datetime.now()))
 os.mkdir(base)
@@ -59,3 +68,63 @@ def test_colors():
     assert tools.get_colors(row, True) == expected_min_wins
     assert tools.get_colors(row, False) == expected_max_wins
     assert tools.rgb_fractions_to_html_color(1, 0, 0.5) == "rgb(255,0,127)"
+
+
+def run_staging_phase(run_dir, staging_dir):
+    # Run the staging function of the Slurm job body in the run dir.
+    template = Path(lab.__file__).parent / "data" / "slurm-run-job-body.template"
+    text = template.read_text()
+    start = text.index("function stage_run_files {")
+    end = text.index("function execute_run {")
+    script = text[start:end].replace("%%", "%") + "stage_run_files\n"
+    env = dict(os.environ, LAB_STAGING_DIR=str(staging_dir))
+    subprocess.run(["bash", "-c", script], cwd=run_dir, env=env, check=True)
+
+
+def test_staging(tmp_path):
+    code_dir = tmp_path / "code-src"
+    benchmarks_dir = tmp_path / "benchmarks" / "gripper"
+    staging_dir = tmp_path / "staging"
+    for path in [code_dir, benchmarks_dir]:
+        path.mkdir(parents=True)
+    (code_dir / "solver.py").write_text("")
+    (benchmarks_dir / "domain.pddl").write_text("")
+    (benchmarks_dir / "prob01.pddl").write_text("")
+
+    exp = Experiment(
+        path=str(tmp_path / "exp"),
+        environment=SlurmEnvironment(staging_dir=str(staging_dir)),
+    )
+    exp.add_resource("", str(code_dir), "code-rev")
+    run = exp.add_run()
+    run.add_resource("problem", str(benchmarks_dir / "prob01.pddl"), symlink=True)
+    solver = os.path.join(exp.path, "code-rev", "solver.py")
+    run.add_command("solve", [sys.executable, solver, "{problem}", "output"])
+    run.set_property("id", ["run1"])
+    exp.build()
+    run_dir = Path(exp.path) / "runs-00001-00100" / "00001"
+    assert "stage_args_from_environment" in (run_dir / "run").read_text()
+
+    args = [sys.executable, solver, "prob01.pddl", "output"]
+    entries = staging.read_manifest(run_dir / staging.MANIFEST_FILENAME)
+    # Without staged copies, the original paths are used.
+    assert staging.stage_args(args, entries, str(staging_dir)) == args
+
+    for _ in range(2):
+        run_staging_phase(run_dir, staging_dir)
+    staged_benchmarks = staging_dir / "external" / str(benchmarks_dir).lstrip("/")
+    assert (staged_benchmarks / "domain.pddl").is_file()
+    assert staging.stage_args(args, entries, str(staging_dir)) == [
+        sys.executable,
+        str(staging_dir / "exp" / "code-rev" / "solver.py"),
+        str(staged_benchmarks / "prob01.pddl"),
+        "output",
+    ]
+
+
+def test_group_runs_by_resources_requires_memory_per_cpu(tmp_path):
+    env = SlurmEnvironment(group_runs_by_resources=True)
+    exp = Experiment(path=str(tmp_path / "exp"), environment=env)
+    exp.add_run().add_command("solve", ["solver"], memory_limit=2048)
+    with pytest.raises(SystemExit):
+        env.run_steps([])
@@ -0,0 +1,30 @@
+"""
+Helpers for tests that fetch or parse the run dirs of a small experiment.
+"""
+
+from pathlib import Path
+
+from lab.experiment import Experiment
+
+NUM_RUNS = 12
+
+
+def make_experiment(tmp_path, parsers=()):
+    """Build an experiment with NUM_RUNS runs below *tmp_path*.
+
+    The runs are never executed. Tests write their logs or properties to
+    the run dirs directly.
+    """
+    exp = Experiment(path=str(tmp_path / "exp"))
+    for parser in parsers:
+        exp.add_parser(parser)
+    for index in range(NUM_RUNS):
+        run = exp.add_run()
+        run.add_command("solve", ["solver"])
+        run.set_property("id", [f"run{index:02d}"])
+    exp.build()
+    return exp
+
+
+def get_run_dirs(exp):
+    return sorted(Path(exp.path).glob("runs-*-*/*"))
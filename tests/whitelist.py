@@ -4,15 +4,20 @@ from pathlib import Path
 import lab
 from lab import reports
 from lab.calls.call import Call
+from lab.calls.staging import stage_args_from_environment
 from lab.environments import ArrheniusEnvironment, TetralithEnvironment
+from lab.experiment import Experiment
 
 assert reports.Table.add_col
 assert reports.Table.get_row
 assert reports.Table.set_row_order
 assert lab.tools.deprecated
 assert lab.tools.get_lab_path
+assert Experiment.archive_runs
 
 assert Call
+# Used by run scripts.
+assert stage_args_from_environment
 
 TetralithEnvironment.is_present()
 ArrheniusEnvironment.is_present()